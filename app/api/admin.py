@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Role, Company, Customer, Item, PurchaseHistory
+from .models import Role, Company, Customer, Item, PurchaseHistory, MonthlySpend
 
 
 @admin.register(Role)
@@ -65,7 +65,7 @@ class PurchaseHistoryAdmin(admin.ModelAdmin):
         }),
         ('Pricing Details', {
             'fields': ('quantity', 'unit_price', 'total_price'),
-            'description': 'Unit price is from the item. Total price is calculated automatically.'
+            'description': 'Unit price is captured from the item at the time of purchase. Total price is calculated automatically.'
         }),
         ('Additional Information', {
             'fields': ('notes', 'created_at', 'updated_at'),
@@ -82,3 +82,18 @@ class PurchaseHistoryAdmin(admin.ModelAdmin):
         return obj.item.name
     get_item_name.short_description = 'Item'
     get_item_name.admin_order_field = 'item__name'
+
+
+@admin.register(MonthlySpend)
+class MonthlySpendAdmin(admin.ModelAdmin):
+    list_display = ['customer', 'item', 'month', 'purchase_count', 'quantity', 'amount']
+    list_select_related = ['customer__user', 'customer__role', 'item']
+    search_fields = ['customer__user__username', 'item__name']
+    raw_id_fields = ['customer', 'item']
+    readonly_fields = ['customer', 'item', 'month', 'purchase_count', 'quantity', 'amount', 'updated_at']
+    ordering = ['-month']
+    date_hierarchy = 'month'
+    
+    def has_add_permission(self, request):
+        # Maintained from PurchaseHistory; see the rebuild_monthly_spend command
+        return False
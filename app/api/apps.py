@@ -7,6 +7,8 @@ class ApiConfig(AppConfig):
 
     def ready(self):
         """
-        Import signals when the app is ready.
+        Import signals and install the request timing hooks when the app is ready.
         """
         import api.signals  # noqa
+        from api import timing
+        timing.install()
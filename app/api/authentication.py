@@ -0,0 +1,70 @@
+"""
+Authentication classes for the API.
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import router
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+# Everything request.user needs except the password hash; the cached user
+# is rebuilt with the password deferred (loaded on first access)
+USER_CACHE_FIELDS = [field.attname for field in User._meta.concrete_fields if field.name != 'password']
+
+
+def token_cache_key(key):
+    # Hash the token so raw credentials never end up in the cache backend
+    return 'auth:token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def user_token_cache_key(user_id):
+    return f'auth:user-token:{user_id}'
+
+
+def invalidate_token(key):
+    """Forget a cached token (called when the token is deleted)"""
+    cache.delete(token_cache_key(key))
+
+
+def invalidate_user_tokens(user_id):
+    """Forget the cached token of a user (called when the user changes)"""
+    cache_key = cache.get(user_token_cache_key(user_id))
+    if cache_key is not None:
+        cache.delete_many([cache_key, user_token_cache_key(user_id)])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Drop-in replacement for TokenAuthentication that caches the
+    token -> user resolution for TOKEN_AUTH_CACHE_TIMEOUT seconds.
+
+    Entries are invalidated by signal handlers (api.signals) once a token
+    delete (logout) or user save (e.g. deactivation) commits, so a revoked
+    token stops working immediately. Entries hold the user's fields minus
+    the password hash, keyed by a hash of the token. Use a shared cache
+    backend when running more than one process.
+    """
+
+    def authenticate_credentials(self, key):
+        cache_key = token_cache_key(key)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return self.rebuild(key, *cached)
+
+        user, token = super().authenticate_credentials(key)
+        timeout = getattr(settings, 'TOKEN_AUTH_CACHE_TIMEOUT', 60)
+        # Neither the raw token nor the password hash is cached
+        cache.set_many({
+            cache_key: ([getattr(user, name) for name in USER_CACHE_FIELDS], token.created),
+            user_token_cache_key(user.pk): cache_key,
+        }, timeout)
+        return user, token
+
+    def rebuild(self, key, user_values, created):
+        user = User.from_db(router.db_for_read(User), USER_CACHE_FIELDS, user_values)
+        token = Token(key=key, user=user, created=created)
+        token._state.adding = False
+        return user, token
@@ -0,0 +1,91 @@
+"""
+Micro-benchmarks for the API routes and console pages.
+
+collect_routes() lists one URL per GET route: every router list/detail
+endpoint, every GET extra action, and every console page.
+measure_route() requests a URL repeatedly and reports latency percentiles,
+the query count and peak Python memory. The run_bench command runs them
+against seed_bench datasets of several sizes and prints JSON.
+"""
+import time
+import tracemalloc
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from console import urls as console_urls
+from .urls import router
+
+
+def collect_routes(detail_pks):
+    """
+    Return ``(name, url)`` pairs for every GET route.
+    ``detail_pks`` maps a router basename to the pk used for detail URLs;
+    basenames without one only get their list routes.
+    """
+    routes = []
+    for prefix, viewset, basename in router.registry:
+        pk = detail_pks.get(basename)
+        routes.append((f'api:{basename}-list', f'/api/{prefix}/'))
+        if pk is not None:
+            routes.append((f'api:{basename}-detail', f'/api/{prefix}/{pk}/'))
+        for action in viewset.get_extra_actions():
+            if 'get' not in action.mapping or (action.detail and pk is None):
+                continue
+            base = f'/api/{prefix}/{pk}/' if action.detail else f'/api/{prefix}/'
+            routes.append((f'api:{basename}-{action.url_name}', f'{base}{action.url_path}/'))
+
+    for pattern in console_urls.urlpatterns:
+        kwargs = {}
+        if 'company_id' in pattern.pattern.converters:
+            if detail_pks.get('company') is None:
+                continue
+            kwargs['company_id'] = detail_pks['company']
+        routes.append((f'console:{pattern.name}', reverse(pattern.name, kwargs=kwargs)))
+    return routes
+
+
+def _request(client, url, **extra):
+    response = client.get(url, **extra)
+    if response.streaming:
+        # Exports do their work while the body is consumed
+        for _chunk in response.streaming_content:
+            pass
+    return response
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(samples)
+    index = max(round(fraction * len(ordered) + 0.5) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def measure_route(client, url, repeat=20, **extra):
+    """
+    Time ``repeat`` GETs of ``url`` (after one warm-up request), then make
+    one more under tracemalloc so tracing does not skew the timings.
+    """
+    _request(client, url, **extra)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _request(client, url, **extra)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    with CaptureQueriesContext(connection) as queries:
+        tracemalloc.start()
+        try:
+            response = _request(client, url, **extra)
+            _current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'status': response.status_code,
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'queries': len(queries),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
@@ -0,0 +1,91 @@
+"""
+Conditional GET (ETag / Last-Modified) support for the router viewsets.
+
+Validators are computed before anything is serialized, from one aggregate
+query over the requested rows (``COUNT``, ``MAX(id)``, ``MAX(updated_at)``)
+and from the version of the viewset's change namespace (see
+api.response_cache), which the signals bump whenever a model nested in or
+counted by the response changes. A client polling an unchanged resource
+gets ``304 Not Modified`` for the cost of that query.
+"""
+import hashlib
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from . import response_cache
+
+
+def row_version(queryset):
+    """``(count, max_id, last_modified)`` of ``queryset``, read with one aggregate query"""
+    queryset = queryset.order_by().select_related(None).prefetch_related(None)
+    aggregates = {'count': Count('pk'), 'last_id': Max('pk')}
+    if any(field.name == 'updated_at' for field in queryset.model._meta.concrete_fields):
+        aggregates['last_modified'] = Max('updated_at')
+    version = queryset.aggregate(**aggregates)
+    return version['count'], version['last_id'], version.get('last_modified')
+
+
+class ConditionalGetMixin:
+    """
+    Answer GET list/retrieve with ETag and Last-Modified headers, and with
+    ``304 Not Modified`` when the client's copy is current.
+
+    The validators cover the requested object (detail) or the filtered
+    queryset (list) plus ``conditional_namespace``: the response cache
+    namespace whose dependencies are the models nested in or counted by
+    the response (users, memberships, ...). Like the response cache, this
+    needs a shared cache backend when running more than one process. The
+    ETag also covers the full URL and the negotiated format. Cursor-paginated
+    lists are served without validators, since they exist to avoid counting
+    the whole queryset.
+    """
+
+    conditional_namespace = None
+
+    def conditional_response(self, request, rows, handler, *args, **kwargs):
+        """Serve ``handler`` under validators built from ``rows`` (see row_version)"""
+        count, last_id, last_modified = rows
+        version = response_cache.current_version(self.conditional_namespace) if self.conditional_namespace else None
+        if version is not None:
+            # Namespace versions are nanosecond timestamps of the last change
+            changed = datetime.fromtimestamp(version / 1e9, tz=dt_timezone.utc)
+            last_modified = max(last_modified, changed) if last_modified else changed
+        # HTTP dates have one-second resolution; If-None-Match takes precedence
+        last_modified = int(last_modified.timestamp()) if last_modified else None
+        fingerprint = repr((
+            request.get_full_path(), request.accepted_renderer.format, count, last_id, last_modified, version
+        ))
+        etag = '"%s"' % hashlib.sha256(fingerprint.encode()).hexdigest()[:32]
+
+        not_modified = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        uses_cursor = getattr(self.paginator, 'uses_cursor', None)
+        if uses_cursor is not None and uses_cursor(request):
+            return super().list(request, *args, **kwargs)
+        rows = row_version(self.filter_queryset(self.get_queryset()))
+        return self.conditional_response(request, rows, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            rows = row_version(self.filter_queryset(self.get_queryset()).filter(
+                **{self.lookup_field: kwargs[lookup_url_kwarg]}
+            ))
+        except (TypeError, ValueError, ValidationError):
+            # Malformed lookup value: let get_object() answer 404
+            return super().retrieve(request, *args, **kwargs)
+        return self.conditional_response(request, rows, super().retrieve, *args, **kwargs)
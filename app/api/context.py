@@ -0,0 +1,66 @@
+"""
+Request-scoped access to the caller's customer profile.
+
+``CustomerContextMiddleware`` attaches a lazy ``CustomerContext`` to every
+request as ``request.customer_context``; API and console views read the
+caller's customer, role and company IDs from it so each is loaded at most
+once per request. Use ``get_customer_context(request)`` rather than the
+attribute directly so code also works for requests that did not go
+through the middleware (e.g. APIRequestFactory in tests).
+"""
+from functools import cached_property
+
+from .models import Customer, Role
+
+
+class CustomerContext:
+    """The current user's Customer (with cached role) and company IDs, loaded lazily"""
+
+    def __init__(self, request):
+        self._request = request
+
+    @cached_property
+    def customer(self):
+        """The user's Customer with its role, or None"""
+        # Read the user at first access: DRF authenticates inside the view
+        # and sets the user on the underlying HttpRequest.
+        user = self._request.user
+        if not user.is_authenticated:
+            return None
+        customer = Customer.objects.filter(user=user).first()
+        if customer is not None:
+            # Attach the role from the process-local registry instead of a JOIN
+            customer.role = Role.get_cached_by_id(customer.role_id)
+        return customer
+
+    @property
+    def role(self):
+        return self.customer.role if self.customer else None
+
+    @property
+    def role_name(self):
+        return self.role.name if self.role else None
+
+    @property
+    def can_manage(self):
+        """Whether the user is an owner or a manager"""
+        return self.role_name in (Role.OWNER, Role.MANAGER)
+
+    @cached_property
+    def company_ids(self):
+        """IDs of the user's companies, read from the through table"""
+        if self.customer is None:
+            return frozenset()
+        through = Customer.companies.through
+        return frozenset(
+            through.objects.filter(customer_id=self.customer.pk).values_list('company_id', flat=True)
+        )
+
+
+def get_customer_context(request):
+    """Return the request's CustomerContext, creating it if needed"""
+    request = getattr(request, '_request', request)
+    context = getattr(request, 'customer_context', None)
+    if context is None:
+        context = request.customer_context = CustomerContext(request)
+    return context
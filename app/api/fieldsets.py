@@ -0,0 +1,84 @@
+"""
+Sparse fieldsets (``?fields=``) and explicit expansion (``?expand=``).
+
+``?fields=id,username,companies_detail.name`` keeps only the listed
+fields; a dotted name selects fields of a nested serializer.
+``?expand=role_detail`` keeps every plain field but only the listed nested
+serializers; ``?expand=`` (empty) drops all of them. Listing a nested
+field in ``?fields=`` expands it as well.
+
+Both are resolved into a *selection*: None (everything) or a sorted tuple
+of ``(name, selection)`` pairs, one per kept readable field. Selections
+are hashable, so query plans can be cached per selection (see
+api.query_plan). Write-only fields are never removed.
+"""
+from rest_framework import serializers
+
+
+def parse_fields(value):
+    """``'a,b.c,b.d'`` -> ``{'a': {}, 'b': {'c': {}, 'd': {}}}``"""
+    tree = {}
+    for name in value.split(','):
+        name = name.strip()
+        if not name:
+            continue
+        node = tree
+        for part in name.split('.'):
+            node = node.setdefault(part, {})
+    return tree
+
+
+def is_nested(field):
+    return isinstance(field, serializers.BaseSerializer)
+
+
+def _fields_of(serializer):
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    return serializer.fields
+
+
+def select_fields(serializer, fields=None, expand=None, prefix=''):
+    """
+    Resolve the ``fields`` tree (see parse_fields) and the ``expand`` names
+    against ``serializer``. Raises ValueError naming unknown fields.
+    """
+    if fields is None and expand is None:
+        return None
+    readable = {name: field for name, field in _fields_of(serializer).items() if not field.write_only}
+
+    names = list(readable) if fields is None else list(fields)
+    unknown = [prefix + name for name in names if name not in readable]
+    if expand is not None:
+        unknown += [prefix + name for name in expand if not is_nested(readable.get(name))]
+        names = [
+            name for name in names
+            if name in expand or (fields is not None and name in fields) or not is_nested(readable[name])
+        ]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+
+    selection = []
+    for name in names:
+        subtree = fields.get(name) if fields is not None else None
+        if subtree and not is_nested(readable[name]):
+            raise ValueError(f'{prefix}{name} has no nested fields')
+        child = select_fields(readable[name], subtree, None, f'{prefix}{name}.') if subtree else None
+        selection.append((name, child))
+    return tuple(sorted(selection))
+
+
+def prune_serializer(serializer, selection):
+    """Remove the readable fields of ``serializer`` that ``selection`` does not keep"""
+    if selection is None:
+        return serializer
+    fields = _fields_of(serializer)
+    keep = dict(selection)
+    for name, field in list(fields.items()):
+        if field.write_only:
+            continue
+        if name not in keep:
+            del fields[name]
+        elif keep[name] is not None:
+            prune_serializer(field, keep[name])
+    return serializer
@@ -0,0 +1,50 @@
+"""
+FilterSets for the API viewsets.
+"""
+from datetime import datetime, time, timedelta
+
+import django_filters
+from django.utils import timezone
+from django_filters.constants import EMPTY_VALUES
+
+from .models import PurchaseHistory
+
+
+class PurchaseDateFilter(django_filters.DateFilter):
+    """
+    Date bound on ``purchase_date``.
+    Dates are turned into datetime bounds (``>= start of day`` or
+    ``< start of next day``) instead of ``__date`` lookups, so the
+    ``(customer, -purchase_date)`` index stays usable.
+    """
+
+    def __init__(self, *args, end=False, **kwargs):
+        self.end = end
+        kwargs.setdefault('field_name', 'purchase_date')
+        kwargs['lookup_expr'] = 'lt' if end else 'gte'
+        super().__init__(*args, **kwargs)
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        if self.end:
+            value += timedelta(days=1)
+        bound = timezone.make_aware(datetime.combine(value, time.min))
+        return super().filter(qs, bound)
+
+
+class PurchaseHistoryFilter(django_filters.FilterSet):
+    """
+    Filters for purchase history.
+    ``from`` and ``to`` are inclusive dates (YYYY-MM-DD).
+    """
+
+    class Meta:
+        model = PurchaseHistory
+        fields = ['customer', 'item', 'customer__user__username']
+
+
+# "from" is a Python keyword, so the date range filters cannot be declared
+# as class attributes.
+PurchaseHistoryFilter.base_filters['from'] = PurchaseDateFilter(label='From date')
+PurchaseHistoryFilter.base_filters['to'] = PurchaseDateFilter(end=True, label='To date')
@@ -0,0 +1,250 @@
+"""
+Bulk-import users and their Customer profiles from a CSV or NDJSON file.
+
+Rows are read one at a time and written in batches: one bulk INSERT for
+users, one for customers and one for company memberships per batch. Per-row
+signals (create_customer_profile, token invalidation) are bypassed, and
+password hashing - the slowest part of creating a user - runs in a process
+pool.
+
+Recognised columns: username (required), email, password, first_name,
+last_name, phone, address, date_of_birth (YYYY-MM-DD), profile_picture,
+bio, role (owner/manager/customer, default customer) and companies (company
+IDs; a list in NDJSON, separated by ';' in CSV). Rows without a password
+get an unusable one.
+"""
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import islice
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_date
+
+from api import response_cache
+from api.models import Company, Customer, Role
+
+USER_FIELDS = ['email', 'first_name', 'last_name']
+CUSTOMER_FIELDS = ['phone', 'address', 'profile_picture', 'bio']
+# Columns that must hold strings (NDJSON can hold any JSON value)
+TEXT_FIELDS = ['username', 'password', 'role', 'date_of_birth', *USER_FIELDS, *CUSTOMER_FIELDS]
+ROLE_NAMES = {name for name, _label in Role.ROLE_CHOICES}
+
+
+def _init_worker():
+    # Workers started with 'spawn' do not inherit the configured settings
+    django.setup()
+
+
+def _hash_password(raw):
+    return make_password(raw or None)
+
+
+def read_csv(stream):
+    for row in csv.DictReader(stream):
+        companies = row.get('companies') or ''
+        row['companies'] = [value for value in companies.split(';') if value.strip()]
+        yield row
+
+
+def read_ndjson(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+READERS = {
+    'csv': read_csv,
+    'ndjson': read_ndjson,
+}
+
+
+class Command(BaseCommand):
+    help = 'Bulk-import users and customer profiles from a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or '-' for standard input")
+        parser.add_argument(
+            '--format',
+            choices=sorted(READERS),
+            help='Input format (default: guessed from the file extension)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rows written per batch (default: 1000)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Processes used to hash passwords; 1 hashes in-process (default: CPU count)',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format']
+        if input_format is None:
+            input_format = 'ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv'
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        self.company_ids = set(Company.objects.values_list('id', flat=True))
+        self.created = self.skipped = 0
+        self.started = time.monotonic()
+
+        try:
+            stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        except OSError as exc:
+            raise CommandError(f'Cannot read {path}: {exc}')
+        workers = max(options['workers'], 1)
+        pool = ProcessPoolExecutor(workers, initializer=_init_worker) if workers > 1 else nullcontext()
+
+        with stream, pool:
+            rows = enumerate(READERS[input_format](stream), start=1)
+            while batch := list(islice(rows, options['batch_size'])):
+                self.import_batch(batch, pool if workers > 1 else None)
+                self.report_progress()
+
+        # bulk_create() sends no signals
+        response_cache.invalidate_all()
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {self.created} customers, skipped {self.skipped} rows '
+            f'in {time.monotonic() - self.started:.1f}s'
+        ))
+
+    def skip(self, line, reason):
+        self.skipped += 1
+        self.stderr.write(f'Row {line}: {reason}')
+
+    def clean_row(self, line, row, seen):
+        """Return the cleaned row, or None (after reporting why) if it is skipped"""
+        if not isinstance(row, dict):
+            return self.skip(line, 'not a JSON object')
+        not_text = [field for field in TEXT_FIELDS if row.get(field) is not None and not isinstance(row[field], str)]
+        if not_text:
+            return self.skip(line, f"{', '.join(not_text)} must be text")
+        username = (row.get('username') or '').strip()
+        if not username or len(username) > 150:
+            return self.skip(line, 'missing or too long username')
+        if username in seen:
+            return self.skip(line, f'duplicate username {username!r}')
+
+        role = row.get('role') or Role.CUSTOMER
+        if role not in ROLE_NAMES:
+            return self.skip(line, f'unknown role {role!r}')
+        date_of_birth = row.get('date_of_birth') or None
+        if date_of_birth is not None:
+            try:
+                date_of_birth = parse_date(date_of_birth)
+            except (TypeError, ValueError):
+                date_of_birth = None
+            if date_of_birth is None:
+                return self.skip(line, 'invalid date_of_birth')
+        if not isinstance(row.get('companies') or [], list):
+            return self.skip(line, 'companies must be a list of company IDs')
+        try:
+            companies = {int(value) for value in row.get('companies') or []}
+        except (TypeError, ValueError):
+            return self.skip(line, 'company IDs must be integers')
+        unknown = companies - self.company_ids
+        if unknown:
+            return self.skip(line, f'unknown companies {sorted(unknown)}')
+
+        seen.add(username)
+        return {
+            **{field: row.get(field) or '' for field in USER_FIELDS + CUSTOMER_FIELDS},
+            'username': username,
+            'password': row.get('password') or '',
+            'role': role,
+            'date_of_birth': date_of_birth,
+            'companies': companies,
+        }
+
+    def import_batch(self, batch, pool):
+        seen = set()
+        cleaned = [(line, self.clean_row(line, row, seen)) for line, row in batch]
+        cleaned = [(line, row) for line, row in cleaned if row is not None]
+
+        existing = set(
+            User.objects.filter(username__in=[row['username'] for _line, row in cleaned])
+            .values_list('username', flat=True)
+        )
+        rows = []
+        for line, row in cleaned:
+            if row['username'] in existing:
+                self.skip(line, f"user {row['username']!r} already exists")
+            else:
+                rows.append(row)
+        if not rows:
+            return
+
+        passwords = [row['password'] for row in rows]
+        if pool is not None:
+            hashes = list(pool.map(_hash_password, passwords, chunksize=max(len(passwords) // 32, 1)))
+        else:
+            hashes = [_hash_password(password) for password in passwords]
+
+        # bulk_create() sends no post_save, so profiles are created here
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(
+                    username=row['username'],
+                    password=password,
+                    **{field: row[field] for field in USER_FIELDS},
+                )
+                for row, password in zip(rows, hashes)
+            ])
+            if any(user.pk is None for user in users):
+                # Backends that cannot return IDs from a bulk insert
+                user_ids = dict(
+                    User.objects.filter(username__in=[user.username for user in users])
+                    .values_list('username', 'id')
+                )
+                for user in users:
+                    user.pk = user_ids[user.username]
+
+            customers = Customer.objects.bulk_create([
+                Customer(
+                    user=user,
+                    role=Role.get_cached(row['role']),
+                    date_of_birth=row['date_of_birth'],
+                    **{field: row[field] for field in CUSTOMER_FIELDS},
+                )
+                for user, row in zip(users, rows)
+            ])
+            if any(customer.pk is None for customer in customers):
+                customer_ids = dict(
+                    Customer.objects.filter(user__in=users).values_list('user_id', 'id')
+                )
+                for customer in customers:
+                    customer.pk = customer_ids[customer.user_id]
+
+            through = Customer.companies.through
+            through.objects.bulk_create([
+                through(customer_id=customer.pk, company_id=company_id)
+                for customer, row in zip(customers, rows)
+                for company_id in row['companies']
+            ])
+        self.created += len(rows)
+
+    def report_progress(self):
+        elapsed = time.monotonic() - self.started
+        rate = self.created / elapsed if elapsed else 0
+        self.stdout.write(
+            f'{self.created} imported, {self.skipped} skipped ({rate:.0f} rows/s)'
+        )
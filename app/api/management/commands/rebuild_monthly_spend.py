@@ -0,0 +1,46 @@
+"""
+Rebuild the MonthlySpend rollup from PurchaseHistory.
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import MonthlySpend, PurchaseHistory
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the monthly spend rollup table from purchase history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rollup rows inserted per query (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        rows = PurchaseHistory.objects.spend_totals().order_by('customer_id', 'item_id', 'month')
+
+        created = 0
+        with transaction.atomic():
+            MonthlySpend.objects.all().delete()
+            batch = []
+            for row in rows.iterator(chunk_size=batch_size):
+                batch.append(MonthlySpend(
+                    customer_id=row['customer_id'],
+                    item_id=row['item_id'],
+                    month=MonthlySpend.month_of(row['month']),
+                    purchase_count=row['purchase_count'],
+                    quantity=row['total_quantity'],
+                    amount=row['amount'],
+                ))
+                if len(batch) >= batch_size:
+                    MonthlySpend.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            if batch:
+                MonthlySpend.objects.bulk_create(batch)
+                created += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {created} monthly spend rows'))
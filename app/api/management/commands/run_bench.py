@@ -0,0 +1,115 @@
+"""
+Run the API / console micro-benchmarks at several dataset sizes.
+
+Each size is seeded with seed_bench in a throwaway test database (the
+configured database is never touched), then every GET route is measured as
+a staff owner who belongs to every company. Results are printed (or
+written with --output) as JSON so runs of different releases can be
+compared.
+"""
+import json
+import platform
+import sys
+
+import django
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from api.benchmarks import collect_routes, measure_route
+from api.models import Company, Customer, Item, PurchaseHistory, Role
+
+
+class Command(BaseCommand):
+    help = 'Benchmark every API route and console page and print the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scales',
+            default='1,10',
+            help='Comma-separated seed_bench scales to run (default: 1,10)',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+            help='Timed requests per route (default: 20)',
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Dataset seed (default: 0)')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        try:
+            scales = [int(scale) for scale in options['scales'].split(',')]
+        except ValueError:
+            raise CommandError('--scales must be a comma-separated list of integers')
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            runs = [self.run_scale(scale, options) for scale in scales]
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'generated_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'repeat': options['repeat'],
+            'seed': options['seed'],
+            'runs': runs,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def run_scale(self, scale, options):
+        self.stderr.write(f'Seeding scale {scale}...')
+        call_command('seed_bench', scale=scale, seed=options['seed'], clear=True, stdout=sys.stderr)
+
+        user, _ = User.objects.get_or_create(username='bench-admin', defaults={'is_staff': True})
+        user.customer.role = Role.get_cached(Role.OWNER)
+        user.customer.save()
+        user.customer.companies.set(Company.objects.all())
+        token, _ = Token.objects.get_or_create(user=user)
+
+        client = Client()
+        client.force_login(user)
+        detail_pks = {
+            'role': user.customer.role_id,
+            'company': Company.objects.order_by('pk').values_list('pk', flat=True).first(),
+            'customer': Customer.objects.order_by('pk').values_list('pk', flat=True).first(),
+            'item': Item.objects.order_by('pk').values_list('pk', flat=True).first(),
+            'user': user.pk,
+            'purchase-history': PurchaseHistory.objects.order_by('pk').values_list('pk', flat=True).first(),
+        }
+
+        routes = []
+        for name, url in collect_routes(detail_pks):
+            self.stderr.write(f'  {url}')
+            extra = {'HTTP_AUTHORIZATION': f'Token {token.key}'} if name.startswith('api:') else {}
+            routes.append({'name': name, 'url': url, **measure_route(client, url, options['repeat'], **extra)})
+
+        return {
+            'scale': scale,
+            'counts': {
+                'companies': Company.objects.count(),
+                'customers': Customer.objects.count(),
+                'items': Item.objects.count(),
+                'purchases': PurchaseHistory.objects.count(),
+            },
+            'routes': routes,
+        }
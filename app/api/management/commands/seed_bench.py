@@ -0,0 +1,200 @@
+"""
+Generate a deterministic synthetic dataset for benchmarks.
+
+The same --seed, --scale and --end-date always produce the same rows.
+Activity is skewed the way production data is: purchases follow a Zipf-like
+distribution over customers (a few whales) and items (a few best sellers),
+and companies get customers the same way.
+
+All generated rows are named with a "bench" prefix, so --clear removes a
+previous benchmark dataset without touching other data.
+"""
+import random
+from datetime import datetime, time as dt_time, timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from api import response_cache
+from api.models import Company, Customer, Item, PurchaseHistory, Role
+
+PREFIX = 'bench'
+
+# Rows generated per unit of --scale
+BASE_COUNTS = {
+    'companies': 5,
+    'customers': 200,
+    'items': 50,
+    'purchases': 2000,
+}
+
+
+def zipf_cum_weights(count, exponent=1.1):
+    """Cumulative weights giving rank r a share proportional to 1 / r**exponent"""
+    return list(accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def clear_bench_data():
+    """Delete every row created by seed_bench"""
+    with transaction.atomic():
+        # Purchases and rollup rows of the bench customers cascade (fast
+        # deletes); only purchases of bench items by others remain
+        User.objects.filter(username__startswith=f'{PREFIX}-').delete()
+        PurchaseHistory.objects.filter(item__name__startswith=f'{PREFIX} ').delete()
+        Item.objects.filter(name__startswith=f'{PREFIX} ').delete()
+        Company.objects.filter(name__startswith=f'{PREFIX} ').delete()
+
+
+class Command(BaseCommand):
+    help = 'Generate a deterministic, skewed benchmark dataset'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale',
+            type=int,
+            default=1,
+            help='Multiplier for the base counts '
+                 + ', '.join(f'{count} {name}' for name, count in BASE_COUNTS.items())
+                 + ' (default: 1)',
+        )
+        for name in BASE_COUNTS:
+            parser.add_argument(f'--{name}', type=int, help=f'Number of {name} (overrides --scale)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+        parser.add_argument(
+            '--end-date',
+            help='Last purchase day, YYYY-MM-DD; purchases span the year before it (default: today)',
+        )
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Delete a previous benchmark dataset first',
+        )
+
+    def handle(self, *args, **options):
+        counts = {
+            name: options[name] if options[name] is not None else base * options['scale']
+            for name, base in BASE_COUNTS.items()
+        }
+        if counts['purchases'] and not (counts['customers'] and counts['items']):
+            raise CommandError('Purchases need at least one customer and one item')
+        end_date = parse_date(options['end_date']) if options['end_date'] else timezone.localdate()
+        if end_date is None:
+            raise CommandError('--end-date must be YYYY-MM-DD')
+        self.end = timezone.make_aware(datetime.combine(end_date, dt_time.max))
+        self.rng = random.Random(options['seed'])
+
+        if options['clear']:
+            clear_bench_data()
+        elif User.objects.filter(username__startswith=f'{PREFIX}-').exists():
+            raise CommandError('A benchmark dataset already exists; use --clear to replace it')
+
+        with transaction.atomic():
+            companies = self.create_companies(counts['companies'])
+            customers = self.create_customers(counts['customers'], companies)
+            items = self.create_items(counts['items'])
+            self.create_purchases(counts['purchases'], customers, items)
+        call_command('rebuild_monthly_spend', stdout=self.stdout)
+        # bulk_create() sends no signals
+        response_cache.invalidate_all()
+
+        self.stdout.write(self.style.SUCCESS(
+            'Seeded ' + ', '.join(f'{count} {name}' for name, count in counts.items())
+        ))
+
+    def create_companies(self, count):
+        return Company.objects.bulk_create([
+            Company(
+                name=f'{PREFIX} Company {index:04d}',
+                email=f'contact@company{index}.example.com',
+            )
+            for index in range(1, count + 1)
+        ])
+
+    def create_customers(self, count, companies):
+        rng = self.rng
+        # Profiles are created below, not by the post_save signal
+        password = make_password(None)
+        users = User.objects.bulk_create([
+            User(
+                username=f'{PREFIX}-{index:06d}',
+                email=f'{PREFIX}-{index}@example.com',
+                first_name=f'First{index}',
+                last_name=f'Last{index}',
+                password=password,
+            )
+            for index in range(1, count + 1)
+        ])
+        roles = [Role.get_cached(name) for name in (Role.OWNER, Role.MANAGER, Role.CUSTOMER)]
+        customers = Customer.objects.bulk_create([
+            Customer(
+                user=user,
+                role=rng.choices(roles, weights=[1, 4, 95])[0],
+                phone=f'010-{rng.randrange(10000):04d}-{rng.randrange(10000):04d}',
+            )
+            for user in users
+        ])
+
+        if companies:
+            cum_weights = zipf_cum_weights(len(companies))
+            through = Customer.companies.through
+            memberships = set()
+            for customer in customers:
+                for company in rng.choices(companies, cum_weights=cum_weights, k=rng.randint(1, 3)):
+                    memberships.add((customer.pk, company.pk))
+            through.objects.bulk_create([
+                through(customer_id=customer_id, company_id=company_id)
+                for customer_id, company_id in sorted(memberships)
+            ])
+        return customers
+
+    def create_items(self, count):
+        rng = self.rng
+        return Item.objects.bulk_create([
+            Item(
+                name=f'{PREFIX} Item {index:04d}',
+                unit_price=Decimal(min(rng.lognormvariate(3, 1), 9999)).quantize(Decimal('0.01')),
+            )
+            for index in range(1, count + 1)
+        ])
+
+    def create_purchases(self, count, customers, items, batch_size=5000):
+        rng = self.rng
+        customer_weights = zipf_cum_weights(len(customers))
+        item_weights = zipf_cum_weights(len(items))
+        seconds_per_year = 365 * 24 * 60 * 60
+        pairs = set()
+
+        for start in range(0, count, batch_size):
+            size = min(batch_size, count - start)
+            buyers = rng.choices(customers, cum_weights=customer_weights, k=size)
+            bought = rng.choices(items, cum_weights=item_weights, k=size)
+            purchases = []
+            for customer, item in zip(buyers, bought):
+                quantity = rng.choices([1, 2, 3, 5, 10], weights=[60, 20, 10, 7, 3])[0]
+                purchases.append(PurchaseHistory(
+                    customer=customer,
+                    item=item,
+                    quantity=quantity,
+                    unit_price=item.unit_price,
+                    total_price=item.unit_price * quantity,
+                ))
+                pairs.add((item.pk, customer.pk))
+            # bulk_create() skips save(), so the prices are set above, and
+            # purchase_date (auto_now_add) is backdated with a second query
+            PurchaseHistory.objects.bulk_create(purchases)
+            for purchase in purchases:
+                purchase.purchase_date = self.end - timedelta(seconds=rng.randrange(seconds_per_year))
+            PurchaseHistory.objects.bulk_update(purchases, ['purchase_date'], batch_size=1000)
+
+        through = Item.customers.through
+        through.objects.bulk_create([
+            through(item_id=item_id, customer_id=customer_id)
+            for item_id, customer_id in sorted(pairs)
+        ])
@@ -0,0 +1,67 @@
+"""
+Batch updates of many-to-many memberships (customer <-> company, item <-> customer).
+"""
+from django.db import transaction
+from django.db.models.signals import m2m_changed
+
+MODE_SET = 'set'
+MODE_ADD = 'add'
+MODE_REMOVE = 'remove'
+MODES = [MODE_SET, MODE_ADD, MODE_REMOVE]
+
+
+def current_related_ids(manager):
+    """Read the related IDs straight from the through table (no join)"""
+    through = manager.through
+    return set(
+        through.objects.filter(**{manager.source_field_name: manager.instance.pk})
+        .values_list(f'{manager.target_field_name}_id', flat=True)
+    )
+
+
+def _send_m2m_changed(manager, action, pk_set):
+    m2m_changed.send(
+        sender=manager.through, instance=manager.instance, action=action,
+        reverse=manager.reverse, model=manager.model, pk_set=pk_set, using=manager.db,
+    )
+
+
+def sync_related_ids(manager, ids, mode=MODE_SET):
+    """
+    Apply a batch of related IDs to an M2M manager (forward or reverse).
+
+    ``set`` makes the relation exactly ``ids``, ``add`` and ``remove`` only
+    add or remove them. The diff is computed against the through table in
+    one query, then written with one bulk insert and one DELETE on the
+    through table. The manager's add()/remove() are not used, since they
+    would read the through table again; ``m2m_changed`` is sent here instead.
+
+    Returns ``(added, removed, total)``: sorted lists of the added and removed
+    IDs, and the number of memberships after the change.
+    """
+    ids = set(ids)
+    through = manager.through
+    source = manager.source_field_name
+    target = manager.target_field_name
+    with transaction.atomic(using=manager.db):
+        current = current_related_ids(manager)
+        added = ids - current if mode in (MODE_SET, MODE_ADD) else set()
+        if mode == MODE_SET:
+            removed = current - ids
+        elif mode == MODE_REMOVE:
+            removed = current & ids
+        else:
+            removed = set()
+        if added:
+            _send_m2m_changed(manager, 'pre_add', added)
+            through.objects.using(manager.db).bulk_create([
+                through(**{f'{source}_id': manager.instance.pk, f'{target}_id': pk}) for pk in added
+            ])
+            _send_m2m_changed(manager, 'post_add', added)
+        if removed:
+            _send_m2m_changed(manager, 'pre_remove', removed)
+            through.objects.using(manager.db).filter(
+                **{source: manager.instance.pk, f'{target}__in': removed}
+            ).delete()
+            _send_m2m_changed(manager, 'post_remove', removed)
+    return sorted(added), sorted(removed), len(current) + len(added) - len(removed)
@@ -0,0 +1,120 @@
+"""
+Middleware for the API app.
+"""
+import itertools
+import json
+import logging
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, JsonResponse
+
+from .context import CustomerContext
+from .profiling import ProfilerBusy, is_staff_request, profile_request
+from .timing import record_query, track_request
+
+timing_logger = logging.getLogger('api.timing')
+logger = logging.getLogger(__name__)
+
+
+class CustomerContextMiddleware:
+    """
+    Attach a lazy CustomerContext as ``request.customer_context``.
+    Nothing is queried until a view reads it.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.customer_context = CustomerContext(request)
+        return self.get_response(request)
+
+
+class ServerTimingMiddleware:
+    """
+    Report where a request spent its time in a ``Server-Timing`` header:
+    database (with the query count), serializer ``.data``, template
+    rendering and the total time spent below this middleware.
+
+    With ``SERVER_TIMING_LOG = True`` the same numbers are also logged as
+    one JSON line on the ``api.timing`` logger. Streaming responses report
+    the time until the response object was returned.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with track_request() as timings, ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(record_query))
+            response = self.get_response(request)
+
+        response['Server-Timing'] = timings.header()
+        if getattr(settings, 'SERVER_TIMING_LOG', False):
+            timing_logger.info(json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                **timings.as_dict(),
+            }))
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Run a request under cProfile.
+
+    On demand: a staff user (session or API token) adds ``?_profile=1`` or
+    an ``X-Profile: 1`` header and gets a JSON report (SQL statements with
+    times, top functions by cumulative time) instead of the normal
+    response; ``?_profile=pstats`` returns the pstats file itself. Other
+    users' requests are handled normally.
+
+    Sampling: with ``PROFILE_SAMPLE_RATE = N`` (N > 0), one request in N is
+    profiled transparently and its profile and report are written to
+    ``PROFILE_DIR``, keeping the newest ``PROFILE_KEEP``. A sampled request
+    that finds the profiler busy is served unprofiled, and failing to
+    write its profile never fails the request.
+    """
+
+    QUERY_PARAM = '_profile'
+    HEADER = 'X-Profile'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+        self.counter = itertools.count(1)
+
+    def __call__(self, request):
+        mode = request.GET.get(self.QUERY_PARAM) or request.headers.get(self.HEADER)
+        if mode and is_staff_request(request):
+            return self.profile_on_demand(request, mode)
+        if self.sample_rate > 0 and next(self.counter) % self.sample_rate == 0:
+            return self.profile_sample(request)
+        return self.get_response(request)
+
+    def profile_sample(self, request):
+        try:
+            profile = profile_request(self.get_response, request)
+        except ProfilerBusy:
+            return self.get_response(request)
+        try:
+            profile.write(Path(settings.PROFILE_DIR), getattr(settings, 'PROFILE_KEEP', 100))
+        except Exception:
+            logger.exception('Could not write the profile of %s', request.get_full_path())
+        return profile.response
+
+    def profile_on_demand(self, request, mode):
+        try:
+            profile = profile_request(self.get_response, request, consume_stream=True)
+        except ProfilerBusy as exc:
+            return JsonResponse({'error': f'Profiler busy, retry later ({exc})'}, status=503)
+        if mode == 'pstats':
+            response = HttpResponse(profile.pstats_bytes(), content_type='application/octet-stream')
+            response['Content-Disposition'] = 'attachment; filename="request.prof"'
+            return response
+        return JsonResponse(profile.report)
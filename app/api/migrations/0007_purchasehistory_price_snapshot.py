@@ -0,0 +1,49 @@
+# Generated by Django 5.2.7 on 2025-11-03 09:12
+
+from django.db import migrations, models
+from django.db.models import ExpressionWrapper, F, OuterRef, Subquery
+
+
+def snapshot_existing_prices(apps, schema_editor):
+    """Copy each item's current unit price onto its existing purchases"""
+    Item = apps.get_model('api', 'Item')
+    PurchaseHistory = apps.get_model('api', 'PurchaseHistory')
+    item_price = Item.objects.filter(pk=OuterRef('item_id')).values('unit_price')[:1]
+    PurchaseHistory.objects.update(unit_price=Subquery(item_price))
+    PurchaseHistory.objects.update(
+        total_price=ExpressionWrapper(
+            F('quantity') * F('unit_price'),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_remove_purchasehistory_total_price_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchasehistory',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, help_text='Price per unit at the time of purchase', max_digits=10),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='purchasehistory',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, help_text='Total price (quantity * unit_price)', max_digits=12),
+            preserve_default=False,
+        ),
+        migrations.RunPython(snapshot_existing_prices, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='purchasehistory',
+            index=models.Index(fields=['-total_price'], name='api_purchas_total_p_c5f64d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchasehistory',
+            index=models.Index(fields=['customer', '-total_price'], name='api_purchas_custome_46bf7b_idx'),
+        ),
+    ]
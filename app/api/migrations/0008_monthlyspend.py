@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+
+def populate_monthly_spend(apps, schema_editor):
+    """Build the rollup for purchases that already exist"""
+    MonthlySpend = apps.get_model('api', 'MonthlySpend')
+    PurchaseHistory = apps.get_model('api', 'PurchaseHistory')
+    rows = (
+        PurchaseHistory.objects.order_by()
+        .annotate(month=TruncMonth('purchase_date'))
+        .values('customer_id', 'item_id', 'month')
+        .annotate(purchase_count=Count('id'), total_quantity=Sum('quantity'), amount=Sum('total_price'))
+    )
+    MonthlySpend.objects.bulk_create([
+        MonthlySpend(
+            customer_id=row['customer_id'],
+            item_id=row['item_id'],
+            month=row['month'].date(),
+            purchase_count=row['purchase_count'],
+            quantity=row['total_quantity'],
+            amount=row['amount'],
+        )
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_purchasehistory_price_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlySpend',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month')),
+                ('purchase_count', models.PositiveIntegerField(default=0)),
+                ('quantity', models.PositiveIntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_spend', to='api.customer')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_spend', to='api.item')),
+            ],
+            options={
+                'verbose_name_plural': 'Monthly Spend',
+                'ordering': ['-month'],
+                'indexes': [models.Index(fields=['customer', '-month'], name='api_monthly_custome_61b6d7_idx')],
+                'constraints': [models.UniqueConstraint(fields=('customer', 'item', 'month'), name='unique_monthly_spend')],
+            },
+        ),
+        migrations.RunPython(populate_monthly_spend, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,37 @@
-from django.db import models
+import datetime
+from decimal import Decimal
+
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Coalesce, TruncDay, TruncMonth, TruncWeek
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 # Create your models here.
 
+class CustomerCountQuerySet(models.QuerySet):
+    """QuerySet for models related to Customer through a ``customers`` relation"""
+
+    def with_customer_count(self):
+        """
+        Annotate each row with ``customer_count``.
+        A correlated subquery is used instead of JOIN + GROUP BY so the
+        annotation stays correct when the queryset is later filtered or
+        used as a prefetch queryset over the same relation.
+        """
+        relation = self.model._meta.get_field('customers')
+        # Reverse relations (Role, Company) expose the Customer-side field;
+        # Item declares the M2M itself, so use its reverse query name.
+        lookup = relation.field.name if relation.auto_created else relation.related_query_name()
+        counts = (
+            Customer.objects.filter(**{lookup: models.OuterRef('pk')})
+            .order_by()
+            .values(lookup)
+            .annotate(count=models.Count('pk'))
+            .values('count')
+        )
+        return self.annotate(customer_count=Coalesce(models.Subquery(counts), 0))
+
+
 class Role(models.Model):
     """Role model for defining user roles"""
     OWNER = 'owner'
@@ -25,11 +54,63 @@ class Role(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    DEFAULT_DESCRIPTIONS = {
+        OWNER: 'Owner role with full access',
+        MANAGER: 'Manager role with management access',
+        CUSTOMER: 'Standard customer role',
+    }
+    
+    objects = CustomerCountQuerySet.as_manager()
+    
+    # Process-local registry of all roles, keyed by name (see get_cached)
+    _registry = None
+    
     class Meta:
         ordering = ['name']
     
     def __str__(self):
         return self.get_name_display()
+    
+    @classmethod
+    def _load_registry(cls):
+        registry = cls._registry
+        if registry is None:
+            registry = cls._registry = {role.name: role for role in cls.objects.all()}
+        return registry
+    
+    @classmethod
+    def get_cached(cls, name):
+        """
+        Return the role with this name from a process-local registry,
+        loading all roles with one query the first time (and creating the
+        role if it does not exist yet).
+        The returned instance is shared: treat it as read-only.
+        """
+        role = cls._load_registry().get(name)
+        if role is None:
+            role, _ = cls.objects.get_or_create(
+                name=name,
+                defaults={'description': cls.DEFAULT_DESCRIPTIONS.get(name, '')}
+            )
+            cls._load_registry()[name] = role
+        return role
+    
+    @classmethod
+    def get_cached_by_id(cls, pk):
+        """Return the role with this primary key from the registry, or None"""
+        for role in cls._load_registry().values():
+            if role.pk == pk:
+                return role
+        cls.clear_cache()
+        for role in cls._load_registry().values():
+            if role.pk == pk:
+                return role
+        return None
+    
+    @classmethod
+    def clear_cache(cls):
+        """Drop the registry (called from Role post_save / post_delete)"""
+        cls._registry = None
 
 
 class Company(models.Model):
@@ -43,6 +124,8 @@ class Company(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = CustomerCountQuerySet.as_manager()
+    
     class Meta:
         ordering = ['name']
         verbose_name_plural = 'Companies'
@@ -100,6 +183,8 @@ class Item(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = CustomerCountQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-created_at']
     
@@ -107,6 +192,87 @@ class Item(models.Model):
         return self.name
 
 
+class PurchaseHistoryQuerySet(models.QuerySet):
+    """QuerySet with SQL-side purchase statistics"""
+    GROUP_BY_ITEM = 'item'
+    PERIOD_TRUNCATIONS = {
+        'day': TruncDay,
+        'week': TruncWeek,
+        'month': TruncMonth,
+    }
+    GROUP_BY_CHOICES = [*PERIOD_TRUNCATIONS, GROUP_BY_ITEM]
+    MONEY = models.DecimalField(max_digits=12, decimal_places=2)
+    
+    def _aggregation_base(self):
+        # Drop ordering and eager loading: they only add sort work and joins
+        return self.order_by().select_related(None).prefetch_related(None)
+    
+    def summary(self):
+        """
+        Return total_purchases, total_spent and average_purchase
+        computed with a single aggregate query.
+        """
+        result = self._aggregation_base().aggregate(
+            total_purchases=models.Count('id'),
+            total_spent=Coalesce(models.Sum('total_price'), models.Value(Decimal('0')), output_field=self.MONEY),
+            average_purchase=Coalesce(models.Avg('total_price'), models.Value(Decimal('0')), output_field=self.MONEY),
+        )
+        result['total_spent'] = Decimal(result['total_spent']).quantize(Decimal('0.01'))
+        result['average_purchase'] = Decimal(result['average_purchase']).quantize(Decimal('0.01'))
+        return result
+    
+    def breakdown(self, group_by):
+        """
+        Return per-period (day/week/month) or per-item rows with
+        purchases, quantity and total_spent, in a single GROUP BY query.
+        """
+        queryset = self._aggregation_base()
+        if group_by == self.GROUP_BY_ITEM:
+            queryset = queryset.values('item', item_name=models.F('item__name'))
+            order = ['-total_spent', 'item']
+        else:
+            trunc = self.PERIOD_TRUNCATIONS[group_by]
+            queryset = queryset.annotate(
+                period=trunc('purchase_date', output_field=models.DateField())
+            ).values('period')
+            order = ['period']
+        return queryset.annotate(
+            purchases=models.Count('id'),
+            quantity=models.Sum('quantity'),
+            total_spent=models.Sum('total_price', output_field=self.MONEY),
+        ).order_by(*order)
+    
+    def spend_totals(self):
+        """
+        Return purchase_count, total_quantity and amount per
+        (customer_id, item_id, month), in a single GROUP BY query.
+        """
+        return self._aggregation_base().annotate(
+            month=TruncMonth('purchase_date')
+        ).values('customer_id', 'item_id', 'month').annotate(
+            purchase_count=models.Count('id'),
+            total_quantity=models.Sum('quantity'),
+            amount=models.Sum('total_price'),
+        )
+    
+    def delete(self):
+        """
+        Delete the purchases and subtract them from the MonthlySpend rollup,
+        one update per affected rollup row. Cascades from a deleted Customer
+        bypass this (and stay fast deletes): its rollup rows cascade as well.
+        """
+        with transaction.atomic():
+            for row in self.spend_totals():
+                MonthlySpend.subtract(
+                    row['customer_id'], row['item_id'], MonthlySpend.month_of(row['month']),
+                    row['total_quantity'], row['amount'], purchase_count=row['purchase_count'],
+                )
+            return super().delete()
+    
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class PurchaseHistory(models.Model):
     """Purchase history model to track customer purchases"""
     customer = models.ForeignKey(
@@ -122,29 +288,174 @@ class PurchaseHistory(models.Model):
         help_text="Item that was purchased"
     )
     quantity = models.PositiveIntegerField(default=1, help_text="Quantity purchased")
+    unit_price = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        editable=False,
+        help_text="Price per unit at the time of purchase"
+    )
+    total_price = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        editable=False,
+        help_text="Total price (quantity * unit_price)"
+    )
     purchase_date = models.DateTimeField(auto_now_add=True, help_text="Date and time of purchase")
     notes = models.TextField(blank=True, help_text="Additional notes about the purchase")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = PurchaseHistoryQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-purchase_date']
         verbose_name_plural = 'Purchase Histories'
         indexes = [
             models.Index(fields=['-purchase_date']),
             models.Index(fields=['customer', '-purchase_date']),
+            models.Index(fields=['-total_price']),
+            models.Index(fields=['customer', '-total_price']),
         ]
     
     def __str__(self):
         return f"{self.customer.user.username} - {self.item.name} ({self.quantity}) on {self.purchase_date.strftime('%Y-%m-%d')}"
     
-    @property
-    def unit_price(self):
-        """Get unit price from the item"""
-        return self.item.unit_price
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded item so save() can tell when it was changed
+        instance._loaded_item_id = instance.__dict__.get('item_id')
+        # ...and what this row currently contributes to MonthlySpend
+        instance._recorded_spend = instance.spend_contribution()
+        return instance
     
-    @property
-    def total_price(self):
-        """Calculate total price based on quantity and item's unit price"""
-        return self.quantity * self.item.unit_price
+    def spend_contribution(self):
+        """
+        Return ``(customer_id, item_id, month, quantity, total_price)`` for the
+        MonthlySpend rollup, or None if any of those fields is not loaded.
+        """
+        values = [self.__dict__.get(name) for name in ('customer_id', 'item_id', 'purchase_date', 'quantity', 'total_price')]
+        if None in values:
+            return None
+        customer_id, item_id, purchase_date, quantity, total_price = values
+        return (customer_id, item_id, MonthlySpend.month_of(purchase_date), quantity, total_price)
+    
+    def snapshot_prices(self):
+        """
+        Capture the item's current unit price (for new purchases or when the
+        item changed) and recompute the stored total.
+        Later repricing of the item does not affect existing purchases.
+        """
+        item_changed = self.item_id != getattr(self, '_loaded_item_id', self.item_id)
+        if self.unit_price is None or item_changed:
+            self.unit_price = self.item.unit_price
+            self._loaded_item_id = self.item_id
+        self.total_price = self.quantity * self.unit_price
+    
+    def save(self, *args, **kwargs):
+        self.snapshot_prices()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'unit_price', 'total_price'}
+        # The MonthlySpend rollup is updated by post_save (api.signals)
+        # and must commit or roll back together with the purchase.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        recorded = getattr(self, '_recorded_spend', None) or self.spend_contribution()
+        # Not a post_delete handler: that would disable fast deletes of
+        # purchases when customers are deleted (see the queryset's delete())
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            if recorded is not None:
+                MonthlySpend.subtract(*recorded)
+        return result
+
 
+class MonthlySpend(models.Model):
+    """
+    Rollup of purchases per (customer, item, month).
+    Maintained incrementally from PurchaseHistory saves (see api.signals)
+    and deletes (PurchaseHistory.delete() and its queryset's); rebuild with ``manage.py rebuild_monthly_spend``.
+    """
+    customer = models.ForeignKey(
+        Customer,
+        on_delete=models.CASCADE,
+        related_name='monthly_spend',
+    )
+    item = models.ForeignKey(
+        Item,
+        on_delete=models.CASCADE,
+        related_name='monthly_spend',
+    )
+    month = models.DateField(help_text="First day of the month")
+    purchase_count = models.PositiveIntegerField(default=0)
+    quantity = models.PositiveIntegerField(default=0)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-month']
+        verbose_name_plural = 'Monthly Spend'
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'item', 'month'], name='unique_monthly_spend'),
+        ]
+        indexes = [
+            models.Index(fields=['customer', '-month']),
+        ]
+    
+    def __str__(self):
+        return f"{self.customer_id} - {self.item_id} ({self.month:%Y-%m}): {self.amount}"
+    
+    @staticmethod
+    def month_of(value):
+        """Return the first day of the (local) month containing ``value``"""
+        if isinstance(value, datetime.datetime):
+            value = timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+        return value.replace(day=1)
+    
+    @classmethod
+    def add(cls, customer_id, item_id, month, quantity, amount, purchase_count=1):
+        """Atomically add to a rollup row, creating it if needed"""
+        key = {'customer_id': customer_id, 'item_id': item_id, 'month': month}
+        increments = {
+            'purchase_count': models.F('purchase_count') + purchase_count,
+            'quantity': models.F('quantity') + quantity,
+            'amount': models.F('amount') + amount,
+            'updated_at': timezone.now(),
+        }
+        if cls.objects.filter(**key).update(**increments):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(purchase_count=purchase_count, quantity=quantity, amount=amount, **key)
+        except IntegrityError:
+            # Created concurrently: fall back to incrementing it
+            cls.objects.filter(**key).update(**increments)
+    
+    @classmethod
+    def add_purchases(cls, purchases):
+        """
+        Add purchases to the rollup in one update per (customer, item, month).
+        For purchases inserted with bulk_create(), which skips post_save.
+        """
+        totals = {}
+        for purchase in purchases:
+            customer_id, item_id, month, quantity, amount = purchase.spend_contribution()
+            count, total_quantity, total_amount = totals.get((customer_id, item_id, month), (0, 0, 0))
+            totals[customer_id, item_id, month] = (count + 1, total_quantity + quantity, total_amount + amount)
+        for (customer_id, item_id, month), (count, quantity, amount) in totals.items():
+            cls.add(customer_id, item_id, month, quantity, amount, purchase_count=count)
+    
+    @classmethod
+    def subtract(cls, customer_id, item_id, month, quantity, amount, purchase_count=1):
+        """Atomically subtract from a rollup row, deleting it once empty"""
+        key = {'customer_id': customer_id, 'item_id': item_id, 'month': month}
+        cls.objects.filter(**key).update(
+            purchase_count=models.F('purchase_count') - purchase_count,
+            quantity=models.F('quantity') - quantity,
+            amount=models.F('amount') - amount,
+            updated_at=timezone.now(),
+        )
+        cls.objects.filter(purchase_count__lte=0, **key).delete()
@@ -0,0 +1,56 @@
+"""
+Pagination classes for the API.
+"""
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class OptInCursorPagination(CursorPagination):
+    """
+    Page-number pagination by default, keyset (cursor) pagination on request.
+
+    Clients opt in with ``?pagination=cursor`` and then follow the ``next`` /
+    ``previous`` links, which carry a ``cursor`` parameter. Cursor pages seek
+    on the ordering columns instead of using OFFSET, and skip the COUNT query,
+    so deep pages cost the same as the first one.
+
+    The ordering comes from the view (``ordering`` / OrderingFilter) and should
+    end with a unique column such as ``-id``.
+    """
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    opt_in_query_param = 'pagination'
+    fallback_class = PageNumberPagination
+
+    def uses_cursor(self, request):
+        return (
+            self.cursor_query_param in request.query_params
+            or request.query_params.get(self.opt_in_query_param) == 'cursor'
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.fallback = None if self.uses_cursor(request) else self.fallback_class()
+        if self.fallback is not None:
+            return self.fallback.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.fallback is not None:
+            return self.fallback.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_html_context(self):
+        if self.fallback is not None:
+            return self.fallback.get_html_context()
+        return super().get_html_context()
+
+    def get_schema_operation_parameters(self, view):
+        parameters = self.fallback_class().get_schema_operation_parameters(view)
+        parameters.append({
+            'name': self.opt_in_query_param,
+            'required': False,
+            'in': 'query',
+            'description': 'Set to "cursor" to use cursor pagination',
+            'schema': {'type': 'string', 'enum': ['cursor']},
+        })
+        return parameters + super().get_schema_operation_parameters(view)
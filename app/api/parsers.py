@@ -0,0 +1,32 @@
+"""
+Request parsers for the API.
+"""
+import json
+
+from django.conf import settings
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parses newline-delimited JSON into a list with one entry per non-blank line.
+    Lines that are not valid JSON become None, so callers can report them
+    per row instead of rejecting the whole body.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        rows = []
+        if stream is None:
+            return rows
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rows.append(json.loads(line.decode(encoding)))
+            except ValueError:
+                rows.append(None)
+        return rows
@@ -0,0 +1,158 @@
+"""
+cProfile-based request profiling (see ProfilingMiddleware in api.middleware).
+
+A profiled request produces a pstats profile (open it with
+``python -m pstats``, snakeviz or any pstats viewer) and a JSON report
+with the request's duration, every SQL statement with its time, and the
+functions with the highest cumulative time.
+
+cProfile hooks the whole process (sys.monitoring on Python 3.12+), so
+only one request is profiled at a time; profile_request() raises
+ProfilerBusy instead of waiting when another one is.
+"""
+import cProfile
+import io
+import json
+import marshal
+import pstats
+import re
+import threading
+import time
+from contextlib import ExitStack
+from datetime import datetime
+
+from django.db import connections
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+TOP_FUNCTIONS = 40
+
+_profiler_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Another request (or another profiling tool) holds the profiler"""
+
+
+def is_staff_request(request):
+    """
+    Whether the request comes from a staff user, authenticated either by
+    session or by any of the API's authentication classes.
+    """
+    if request.user.is_authenticated:
+        return request.user.is_staff
+    drf_request = Request(request, authenticators=[
+        auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    ])
+    try:
+        return drf_request.user.is_staff
+    except exceptions.APIException:
+        return False
+
+
+class QueryRecorder:
+    """Database execute wrapper that keeps every SQL statement and its time"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'sql': sql,
+                'duration_ms': round((time.perf_counter() - start) * 1000, 3),
+            })
+
+
+class RequestProfile:
+    """The outcome of profile_request(): response, report and profiler"""
+
+    def __init__(self, request, response, profiler, queries, duration):
+        self.response = response
+        self.profiler = profiler
+        self.report = {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'started_at': datetime.now().isoformat(),
+            'duration_ms': round(duration * 1000, 3),
+            'db_ms': round(sum(query['duration_ms'] for query in queries), 3),
+            'queries': queries,
+            'functions': top_functions(profiler),
+        }
+
+    def pstats_bytes(self):
+        """The profile in the binary format written by pstats.Stats.dump_stats()"""
+        self.profiler.create_stats()
+        return marshal.dumps(self.profiler.stats)
+
+    def write(self, directory, keep):
+        """
+        Save ``<name>.prof`` and ``<name>.json`` in ``directory``, then delete
+        the oldest profiles so that at most ``keep`` remain.
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '-', self.report['path'].split('?')[0]).strip('-') or 'root'
+        name = f"{datetime.now():%Y%m%dT%H%M%S%f}-{self.report['method']}-{slug[:80]}"
+        (directory / f'{name}.prof').write_bytes(self.pstats_bytes())
+        (directory / f'{name}.json').write_text(json.dumps(self.report, indent=2))
+
+        profiles = sorted(directory.glob('*.prof'))
+        for old in profiles[:max(len(profiles) - keep, 0)]:
+            old.unlink(missing_ok=True)
+            old.with_suffix('.json').unlink(missing_ok=True)
+        return directory / f'{name}.prof'
+
+
+def top_functions(profiler, limit=TOP_FUNCTIONS):
+    """The ``limit`` functions with the highest cumulative time"""
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+    return [
+        {
+            'function': pstats.func_std_string(func),
+            'calls': calls,
+            'tottime_ms': round(tottime * 1000, 3),
+            'cumtime_ms': round(cumtime * 1000, 3),
+        }
+        for func, (_primitive, calls, tottime, cumtime, _callers) in rows[:limit]
+    ]
+
+
+def profile_request(get_response, request, consume_stream=False):
+    """
+    Run ``get_response(request)`` under cProfile while recording all SQL.
+    With ``consume_stream``, a streaming response is consumed inside the
+    profile (its body is discarded) so the work it does is included.
+    Raises ProfilerBusy, before handling the request, when the profiler
+    is in use.
+    """
+    if not _profiler_lock.acquire(blocking=False):
+        raise ProfilerBusy('Another request is being profiled')
+    try:
+        recorder = QueryRecorder()
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as exc:
+            # e.g. "Another profiling tool is already active"
+            raise ProfilerBusy(str(exc)) from exc
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            try:
+                response = get_response(request)
+                if consume_stream and response.streaming:
+                    for _chunk in response.streaming_content:
+                        pass
+            finally:
+                profiler.disable()
+        duration = time.perf_counter() - start
+    finally:
+        _profiler_lock.release()
+    return RequestProfile(request, response, profiler, recorder.queries, duration)
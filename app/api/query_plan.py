@@ -0,0 +1,159 @@
+"""
+Query planning for serializers.
+
+Builds the select_related/prefetch_related calls a queryset needs from the
+fields a serializer declares, so nested serializers and dotted sources
+such as ``user.username`` do not trigger a query per row. Plans follow a
+sparse field selection (see api.fieldsets): dropped relations are not
+loaded and unread TextFields are deferred.
+"""
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+from .fieldsets import prune_serializer
+
+
+def _forward_path(model, attrs):
+    """
+    Return the longest leading run of ``attrs`` that follows forward
+    foreign keys / one-to-one fields from ``model`` (select_related-able).
+    """
+    path = []
+    for attr in attrs:
+        try:
+            field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            break
+        if not field.is_relation or not (field.many_to_one or field.one_to_one) or not field.concrete:
+            break
+        path.append(attr)
+        model = field.related_model
+    return path
+
+
+def _nested_queryset(model, serializer, selection):
+    """Queryset for a nested serializer, planned recursively"""
+    return plan_queryset(model._default_manager.all(), serializer, selection)
+
+
+def _deferred_fields(model, fields):
+    """
+    TextFields of ``model`` that none of ``fields`` reads. Fields with
+    ``source='*'`` may read anything, so they disable deferring; method
+    fields are assumed to read annotations only (see below).
+    """
+    read = set()
+    for field in fields:
+        if field.write_only or isinstance(field, serializers.SerializerMethodField):
+            continue
+        if field.source == '*':
+            return ()
+        read.add(field.source_attrs[0])
+    return tuple(
+        field.name for field in model._meta.concrete_fields
+        if isinstance(field, models.TextField) and field.name not in read
+    )
+
+
+def get_query_plan(serializer_class, selection=None):
+    """
+    Return ``(select_related, prefetch_related, defer, annotate)`` for a
+    serializer class and field selection (None: every field).
+
+    Full plans are cached per serializer class. Plans for a selection are
+    built on every call, since selections come from the client (?fields=)
+    and caching them would let clients grow the cache without bound.
+    """
+    if selection is None:
+        return _full_query_plan(serializer_class)
+    return _build_query_plan(serializer_class, selection)
+
+
+@lru_cache(maxsize=None)
+def _full_query_plan(serializer_class):
+    return _build_query_plan(serializer_class, None)
+
+
+def _build_query_plan(serializer_class, selection):
+    """
+    Build the query plan of get_query_plan().
+
+    - Nested serializers (``many=True`` or not) become a ``Prefetch`` whose
+      queryset is itself planned from the nested serializer.
+    - Dotted sources and plain related fields select_related the forward
+      foreign keys they traverse.
+    - Read-only ``many=True`` related fields prefetch their relation.
+    - TextFields no selected field reads are deferred.
+    - Fields backed by model properties select_related the relations the
+      serializer lists for them in ``property_relations``.
+    Write-only fields and ``SerializerMethodField`` are ignored; serializers
+    that read annotations expose them through ``annotate_queryset`` and
+    may name the fields that need them in ``annotated_fields``.
+    """
+    serializer = prune_serializer(serializer_class(), selection)
+    model = serializer.Meta.model
+    nested_selections = dict(selection or ())
+    select_related = []
+    prefetch_related = []
+
+    for name, field in serializer.fields.items():
+        if field.write_only or field.source == '*':
+            continue
+        attrs = field.source_attrs
+
+        if isinstance(field, serializers.ListSerializer):
+            child = field.child
+            related_model = model._meta.get_field(attrs[0]).related_model
+            prefetch_related.append(Prefetch(
+                attrs[0], queryset=_nested_queryset(related_model, child, nested_selections.get(name))
+            ))
+        elif isinstance(field, serializers.ModelSerializer):
+            related_model = model._meta.get_field(attrs[0]).related_model
+            prefetch_related.append(Prefetch(
+                attrs[0], queryset=_nested_queryset(related_model, field, nested_selections.get(name))
+            ))
+        elif isinstance(field, serializers.ManyRelatedField):
+            prefetch_related.append(attrs[0])
+        else:
+            if isinstance(field, serializers.PrimaryKeyRelatedField):
+                # The primary key is read from the local "<name>_id" column.
+                attrs = attrs[:-1]
+            path = _forward_path(model, attrs)
+            if path and '__'.join(path) not in select_related:
+                select_related.append('__'.join(path))
+
+    # Properties hide the relations they read from the loop above
+    property_relations = getattr(serializer_class, 'property_relations', {})
+    for name in serializer.fields:
+        for lookup in property_relations.get(name, ()):
+            if lookup not in select_related:
+                select_related.append(lookup)
+
+    annotated_fields = getattr(serializer_class, 'annotated_fields', None)
+    annotate = hasattr(serializer_class, 'annotate_queryset') and (
+        annotated_fields is None or any(name in serializer.fields for name in annotated_fields)
+    )
+    deferred = _deferred_fields(model, serializer.fields.values()) if selection is not None else ()
+    return tuple(select_related), tuple(prefetch_related), deferred, annotate
+
+
+def plan_queryset(queryset, serializer, selection=None):
+    """
+    Apply the query plan of ``serializer`` (a class or instance) for
+    ``selection`` (see api.fieldsets) to ``queryset``.
+    """
+    serializer_class = serializer if isinstance(serializer, type) else type(serializer)
+    select_related, prefetch_related, deferred, annotate = get_query_plan(serializer_class, selection)
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+    if deferred:
+        queryset = queryset.defer(*deferred)
+    if annotate:
+        queryset = serializer_class.annotate_queryset(queryset)
+    return queryset
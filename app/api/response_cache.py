@@ -0,0 +1,153 @@
+"""
+Server-side cache of list/detail responses for read-mostly endpoints.
+
+Entries are keyed by namespace (one per viewset), the namespace's current
+version, the caller's visibility scope, the response format and the full
+URL. Saving or deleting a model the namespace depends on (see
+RESPONSE_CACHE_DEPENDENCIES, wired up in api.signals) bumps the version
+once the write commits, which orphans every entry of that namespace at
+once; orphans expire after RESPONSE_CACHE_TIMEOUT seconds. Versions are the nanosecond timestamp of
+the namespace's last change, and also serve as the change marker of
+conditional GETs (api.conditional), including for viewsets whose
+responses are not cached. Writes that send no signals (bulk_create,
+queryset.update) call invalidate_all() or rely on the timeout.
+
+Hits and misses are counted per namespace in the cache and reported by
+the ``/api/cache-stats/`` endpoint. Use a shared cache backend when
+running more than one process.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+from rest_framework.response import Response
+
+from .models import Company, Customer, Item, Role
+
+# Namespace -> models whose changes can alter its responses
+RESPONSE_CACHE_DEPENDENCIES = {
+    'roles': (Role, Customer),
+    'companies': (Company, Customer, Customer.companies.through),
+    'items': (Item, Customer, User, Item.customers.through),
+    'customers': (
+        Customer, User, Role, Company, Item, Customer.companies.through, Item.customers.through
+    ),
+    # Not PurchaseHistory: a delete handler would disable fast deletes of
+    # purchases, and conditional GETs already read the purchase rows
+    'purchase-history': (Customer, User, Item),
+}
+
+# Validators are cached with the body so hits can answer 304 as well
+CACHED_HEADERS = ('ETag', 'Last-Modified')
+
+
+def _version_key(namespace):
+    return f'api:response-cache:version:{namespace}'
+
+
+def _counter_key(namespace, outcome):
+    return f'api:response-cache:{outcome}:{namespace}'
+
+
+def _incr(key):
+    # incr() only works on existing keys; add() is a no-op when it exists
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+
+def current_version(namespace):
+    # Seeded from the clock so a version key lost to eviction never comes
+    # back with a number that older entries (or ETags) were built from
+    return cache.get_or_set(_version_key(namespace), time.time_ns, timeout=None)
+
+
+def invalidate(namespace):
+    """Orphan every cached response of a namespace"""
+    key = _version_key(namespace)
+    cache.set(key, max(time.time_ns(), cache.get(key, 0) + 1), timeout=None)
+
+
+def invalidate_all():
+    for namespace in RESPONSE_CACHE_DEPENDENCIES:
+        invalidate(namespace)
+
+
+def record(namespace, hit):
+    _incr(_counter_key(namespace, 'hits' if hit else 'misses'))
+
+
+def stats():
+    """Hit/miss counters and hit rate per namespace"""
+    result = {}
+    for namespace in RESPONSE_CACHE_DEPENDENCIES:
+        hits = cache.get(_counter_key(namespace, 'hits'), 0)
+        misses = cache.get(_counter_key(namespace, 'misses'), 0)
+        total = hits + misses
+        result[namespace] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / total, 4) if total else None,
+        }
+    return result
+
+
+class ResponseCacheMixin:
+    """
+    Serve list/retrieve from the response cache of ``response_cache_namespace``.
+    Put it before ConditionalGetMixin so hits need no database query at all.
+    """
+
+    response_cache_namespace = None
+
+    def get_response_cache_scope(self, request):
+        """What the caller is allowed to see; responses are never shared across scopes"""
+        return 'staff' if request.user.is_staff else 'authenticated'
+
+    def cached_response(self, request, handler, *args, **kwargs):
+        timeout = getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300)
+        if not timeout:
+            return handler(request, *args, **kwargs)
+
+        namespace = self.response_cache_namespace
+        # Read the version first: if the data changes while the response
+        # is built, it is stored under the old version and never served.
+        fingerprint = repr((
+            current_version(namespace),
+            self.get_response_cache_scope(request),
+            request.accepted_renderer.format,
+            request.build_absolute_uri(),
+        ))
+        key = f'api:response-cache:{namespace}:' + hashlib.sha256(fingerprint.encode()).hexdigest()
+
+        entry = cache.get(key)
+        if entry is not None:
+            record(namespace, hit=True)
+            data, headers = entry
+            response = get_conditional_response(
+                request._request,
+                etag=headers.get('ETag'),
+                last_modified=parse_http_date_safe(headers.get('Last-Modified')),
+            ) or Response(data, headers=headers)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        record(namespace, hit=False)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200 and isinstance(response, Response):
+            headers = {name: response[name] for name in CACHED_HEADERS if name in response}
+            cache.set(key, (response.data, headers), timeout)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
@@ -1,9 +1,34 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from .memberships import MODE_SET, MODES
 from .models import Role, Item, Company, Customer, PurchaseHistory
 
 
-class RoleSerializer(serializers.ModelSerializer):
+class CustomerCountMixin:
+    """
+    Serializer mixin for models with a ``customers`` relation.
+    ``customer_count`` is read from the ``with_customer_count()`` annotation,
+    falling back to a COUNT query for instances that were not loaded
+    through it (e.g. freshly created or updated objects).
+    """
+
+    # Fields that read the annotation (see api.query_plan)
+    annotated_fields = ('customer_count',)
+
+    @classmethod
+    def annotate_queryset(cls, queryset):
+        """Annotate the values this serializer reads (see api.query_plan)"""
+        return queryset.with_customer_count()
+
+    def get_customer_count(self, obj):
+        """Get the number of customers related to this object"""
+        count = getattr(obj, 'customer_count', None)
+        if count is None:
+            count = obj.customers.count()
+        return count
+
+
+class RoleSerializer(CustomerCountMixin, serializers.ModelSerializer):
     """Serializer for Role model"""
     customer_count = serializers.SerializerMethodField()
     
@@ -11,13 +36,9 @@ class RoleSerializer(serializers.ModelSerializer):
         model = Role
         fields = ['id', 'name', 'description', 'customer_count', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
-    
-    def get_customer_count(self, obj):
-        """Get the number of customers with this role"""
-        return obj.customers.count()
 
 
-class CompanySerializer(serializers.ModelSerializer):
+class CompanySerializer(CustomerCountMixin, serializers.ModelSerializer):
     """Serializer for Company model"""
     customer_count = serializers.SerializerMethodField()
     
@@ -28,10 +49,6 @@ class CompanySerializer(serializers.ModelSerializer):
             'email', 'website', 'customer_count', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
-    
-    def get_customer_count(self, obj):
-        """Get the number of customers associated with this company"""
-        return obj.customers.count()
 
 
 class ItemSummarySerializer(serializers.ModelSerializer):
@@ -49,6 +66,9 @@ class CustomerSummarySerializer(serializers.ModelSerializer):
     full_name = serializers.CharField(read_only=True)
     role_name = serializers.CharField(source='role.get_name_display', read_only=True)
     
+    # Relations read by model properties (see api.query_plan)
+    property_relations = {'full_name': ('user',)}
+    
     class Meta:
         model = Customer
         fields = ['id', 'username', 'email', 'full_name', 'phone', 'role_name']
@@ -63,6 +83,8 @@ class CustomerSerializer(serializers.ModelSerializer):
     first_name = serializers.CharField(source='user.first_name', read_only=True)
     last_name = serializers.CharField(source='user.last_name', read_only=True)
     full_name = serializers.CharField(read_only=True)
+    # Relations read by model properties (see api.query_plan)
+    property_relations = {'full_name': ('user',)}
     
     # Role information
     role_detail = RoleSerializer(source='role', read_only=True)
@@ -150,10 +172,7 @@ class CustomerCreateSerializer(serializers.ModelSerializer):
         # Get or set role (default to 'customer' if not provided)
         role = validated_data.pop('role', None)
         if role is None:
-            role, _ = Role.objects.get_or_create(
-                name=Role.CUSTOMER,
-                defaults={'description': 'Standard customer role'}
-            )
+            role = Role.get_cached(Role.CUSTOMER)
         
         # Create User
         user = User.objects.create_user(
@@ -164,8 +183,12 @@ class CustomerCreateSerializer(serializers.ModelSerializer):
             last_name=last_name
         )
         
-        # Create Customer with role
-        customer = Customer.objects.create(user=user, role=role, **validated_data)
+        # The post_save signal has already created the profile; fill it in
+        customer = user.customer
+        customer.role = role
+        for field, value in validated_data.items():
+            setattr(customer, field, value)
+        customer.save()
         
         # Add companies
         if companies:
@@ -174,7 +197,35 @@ class CustomerCreateSerializer(serializers.ModelSerializer):
         return customer
 
 
-class ItemSerializer(serializers.ModelSerializer):
+class MembershipBatchSerializer(serializers.Serializer):
+    """Base request body for the batch membership actions"""
+    mode = serializers.ChoiceField(
+        choices=MODES,
+        default=MODE_SET,
+        help_text="set: replace the memberships with the given IDs; add / remove: only add or remove them"
+    )
+
+
+class CompanyIdsBatchSerializer(MembershipBatchSerializer):
+    company_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), max_length=10000)
+
+
+class ItemIdsBatchSerializer(MembershipBatchSerializer):
+    item_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), max_length=10000)
+
+
+class CustomerIdsBatchSerializer(MembershipBatchSerializer):
+    customer_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), max_length=10000)
+
+
+class MembershipChangeSerializer(serializers.Serializer):
+    """Serializer for the batch membership response"""
+    added = serializers.ListField(child=serializers.IntegerField(), read_only=True)
+    removed = serializers.ListField(child=serializers.IntegerField(), read_only=True)
+    total = serializers.IntegerField(read_only=True, help_text="Number of memberships after the change")
+
+
+class ItemSerializer(CustomerCountMixin, serializers.ModelSerializer):
     """Serializer for Item model"""
     customer_count = serializers.SerializerMethodField()
     customers_detail = CustomerSummarySerializer(source='customers', many=True, read_only=True)
@@ -193,10 +244,6 @@ class ItemSerializer(serializers.ModelSerializer):
             'customers_detail', 'customer_ids', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
-    
-    def get_customer_count(self, obj):
-        """Get the number of customers associated with this item"""
-        return obj.customers.count()
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -241,8 +288,6 @@ class PurchaseHistorySerializer(serializers.ModelSerializer):
     customer_email = serializers.CharField(source='customer.user.email', read_only=True)
     item_name = serializers.CharField(source='item.name', read_only=True)
     item_description = serializers.CharField(source='item.description', read_only=True)
-    unit_price = serializers.DecimalField(source='item.unit_price', max_digits=10, decimal_places=2, read_only=True)
-    total_price = serializers.SerializerMethodField()
     
     class Meta:
         model = PurchaseHistory
@@ -255,10 +300,6 @@ class PurchaseHistorySerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'unit_price', 'total_price', 'purchase_date', 'created_at', 'updated_at']
     
-    def get_total_price(self, obj):
-        """Calculate total price"""
-        return obj.total_price
-    
     def validate_quantity(self, value):
         """Validate that quantity is positive"""
         if value <= 0:
@@ -266,16 +307,41 @@ class PurchaseHistorySerializer(serializers.ModelSerializer):
         return value
 
 
+class PurchaseHistoryBulkRowSerializer(serializers.Serializer):
+    """
+    Validates one row of a bulk purchase upload.
+    Customer and item IDs are checked by the view with one IN query each.
+    """
+    customer = serializers.IntegerField()
+    item = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, default=1)
+    notes = serializers.CharField(required=False, allow_blank=True, default='')
+
+
+class PurchaseHistoryBulkResponseSerializer(serializers.Serializer):
+    """Serializer for the bulk purchase upload response"""
+    created = serializers.IntegerField(read_only=True)
+    ids = serializers.ListField(child=serializers.IntegerField(), read_only=True)
+    errors = serializers.ListField(
+        child=serializers.DictField(),
+        read_only=True,
+        help_text="One entry per rejected row: {index, errors}"
+    )
+
+
 class PurchaseHistorySummarySerializer(serializers.ModelSerializer):
     """Lightweight serializer for PurchaseHistory (for nested use)"""
     item_name = serializers.CharField(source='item.name', read_only=True)
-    total_price = serializers.SerializerMethodField()
     
     class Meta:
         model = PurchaseHistory
         fields = ['id', 'item_name', 'quantity', 'total_price', 'purchase_date']
         read_only_fields = ['id', 'total_price', 'purchase_date']
-    
-    def get_total_price(self, obj):
-        """Calculate total price"""
-        return obj.total_price
+
+
+class MonthlySpendSerializer(serializers.Serializer):
+    """Serializer for one month of spend from the MonthlySpend rollup"""
+    month = serializers.DateField(read_only=True, help_text="First day of the month")
+    purchases = serializers.IntegerField(read_only=True)
+    quantity = serializers.IntegerField(read_only=True)
+    total_spent = serializers.DecimalField(max_digits=14, decimal_places=2, read_only=True)
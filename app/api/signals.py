@@ -1,38 +1,127 @@
 """
 Signal handlers for the API app.
 """
-from django.db.models.signals import post_save
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Customer, Role
+from rest_framework.authtoken.models import Token
+from . import response_cache
+from .authentication import invalidate_token, invalidate_user_tokens
+from .models import Customer, MonthlySpend, PurchaseHistory, Role
+
+
+def create_customer_profile(user):
+    """
+    Create the Customer profile (with the 'customer' role) for a user.
+    This is the only place profiles are created automatically.
+    """
+    return Customer.objects.create(user=user, role=Role.get_cached(Role.CUSTOMER))
 
 
 @receiver(post_save, sender=User)
-def create_customer_profile(sender, instance, created, **kwargs):
+def ensure_customer_profile(sender, instance, created, raw=False, update_fields=None, **kwargs):
     """
-    Automatically create a Customer profile when a new User is created.
-    This ensures every user has an associated Customer profile with 'customer' role.
+    Make sure every user has a Customer profile.
+    
+    New users get one immediately. Saving a User never writes to the
+    profile: Customer has no fields derived from User. Partial saves such as
+    Django's last_login update on login are skipped entirely; other saves
+    only check (without writing) that users created before this signal
+    existed have a profile.
     """
+    if raw:
+        return
     if created:
-        # Get or create the 'customer' role
-        customer_role, _ = Role.objects.get_or_create(
-            name=Role.CUSTOMER,
-            defaults={'description': 'Standard customer role'}
-        )
-        Customer.objects.create(user=instance, role=customer_role)
+        create_customer_profile(instance)
+        return
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    if not Customer.objects.filter(user=instance).exists():
+        create_customer_profile(instance)
 
 
-@receiver(post_save, sender=User)
-def save_customer_profile(sender, instance, **kwargs):
+@receiver(pre_save, sender=PurchaseHistory)
+def load_recorded_spend(sender, instance, **kwargs):
     """
-    Save the Customer profile whenever the User is saved.
+    Make sure an updated purchase knows what it contributed to MonthlySpend
+    before the save, even if it was not loaded (completely) from the database.
     """
+    if instance._state.adding or getattr(instance, '_recorded_spend', None) is not None:
+        return
     try:
-        instance.customer.save()
-    except Customer.DoesNotExist:
-        # If for some reason the customer doesn't exist, create it
-        customer_role, _ = Role.objects.get_or_create(
-            name=Role.CUSTOMER,
-            defaults={'description': 'Standard customer role'}
-        )
-        Customer.objects.create(user=instance, role=customer_role)
+        instance._recorded_spend = PurchaseHistory.objects.get(pk=instance.pk).spend_contribution()
+    except PurchaseHistory.DoesNotExist:
+        instance._recorded_spend = None
+
+
+@receiver(post_save, sender=PurchaseHistory)
+def update_monthly_spend(sender, instance, created, **kwargs):
+    """
+    Move the purchase's contribution in the MonthlySpend rollup.
+    Runs inside the transaction opened by PurchaseHistory.save().
+    """
+    previous = None if created else getattr(instance, '_recorded_spend', None)
+    current = instance.spend_contribution()
+    if previous == current:
+        return
+    if previous is not None:
+        MonthlySpend.subtract(*previous)
+    if current is not None:
+        MonthlySpend.add(*current)
+    instance._recorded_spend = current
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, using=None, **kwargs):
+    """
+    Drop a deleted token (logout, or cascade from a deleted user)
+    from the CachedTokenAuthentication cache once the delete commits,
+    so a concurrent request cannot cache the token again before that.
+    """
+    transaction.on_commit(partial(invalidate_token, instance.key), using=using)
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(sender, instance, update_fields=None, using=None, **kwargs):
+    """
+    Drop the user's cached token whenever the user changes (deactivation,
+    password or permission changes), except for last_login-only updates.
+    Runs after commit, like forget_deleted_token.
+    """
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    transaction.on_commit(partial(invalidate_user_tokens, instance.pk), using=using)
+
+
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+def clear_role_cache(sender, **kwargs):
+    """Reload the process-local role registry after any role change"""
+    Role.clear_cache()
+
+
+def invalidate_response_cache(sender, update_fields=None, action=None, using=None, **kwargs):
+    """
+    Orphan the cached responses of every namespace that depends on the sender,
+    once the write commits: bumping the version earlier would let a
+    concurrent request cache the old data under the new version.
+    last_login-only User saves and the pre_* m2m actions are ignored.
+    """
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    if action is not None and not action.startswith('post_'):
+        return
+    for namespace, models in response_cache.RESPONSE_CACHE_DEPENDENCIES.items():
+        if sender in models:
+            transaction.on_commit(partial(response_cache.invalidate, namespace), using=using)
+
+
+for _model in {model for models in response_cache.RESPONSE_CACHE_DEPENDENCIES.values() for model in models}:
+    if _model._meta.auto_created:
+        m2m_changed.connect(invalidate_response_cache, sender=_model, dispatch_uid=f'response-cache-{_model._meta.label}')
+    else:
+        post_save.connect(invalidate_response_cache, sender=_model, dispatch_uid=f'response-cache-save-{_model._meta.label}')
+        post_delete.connect(invalidate_response_cache, sender=_model, dispatch_uid=f'response-cache-delete-{_model._meta.label}')
@@ -1,3 +1,1254 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import pstats
+import shutil
+import tempfile
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from .authentication import CachedTokenAuthentication, token_cache_key, user_token_cache_key
+from .benchmarks import collect_routes, measure_route
+from .models import Role, Company, Customer, Item, PurchaseHistory, MonthlySpend
+from .pagination import OptInCursorPagination
+from .query_plan import _full_query_plan
+
+
+class APITestMixin:
+    """Shared fixtures for API tests"""
+
+    def _pre_setup(self):
+        super()._pre_setup()
+        # Cached tokens and responses must not leak between tests
+        cache.clear()
+
+    def create_user(self, username, password=None, **kwargs):
+        """
+        Create a User (and, through the signal, its Customer profile).
+        Without a password no hash is computed, which keeps the tests fast.
+        """
+        return User.objects.create_user(username=username, password=password, **kwargs)
+
+    def authenticate(self, user=None):
+        user = user or self.create_user('api-user')
+        self.client.force_authenticate(user=user)
+        return user
+
+    def count_queries(self, url, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(ctx.captured_queries)
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=0)
+class CustomerCountTests(APITestMixin, APITestCase):
+    """customer_count is read from an annotation instead of a per-row COUNT"""
+
+    def setUp(self):
+        self.user = self.authenticate()
+        self.customer = self.user.customer
+
+    def test_company_customer_count(self):
+        company = Company.objects.create(name='Acme')
+        Company.objects.create(name='Empty')
+        other = self.create_user('other').customer
+        company.customers.add(self.customer, other)
+
+        response = self.client.get('/api/companies/')
+        counts = {row['name']: row['customer_count'] for row in response.data['results']}
+        self.assertEqual(counts, {'Acme': 2, 'Empty': 0})
+
+    def test_item_customer_count_with_prefetch(self):
+        item = Item.objects.create(name='Widget')
+        item.customers.add(self.customer)
+        self.customer.items.add(Item.objects.create(name='Gadget'))
+
+        response = self.client.get(f'/api/customers/{self.customer.id}/')
+        role = Role.objects.get(name=Role.CUSTOMER)
+        self.assertEqual(response.data['role_detail']['customer_count'], role.customers.count())
+
+        response = self.client.get(f'/api/items/{item.id}/')
+        self.assertEqual(response.data['customer_count'], 1)
+
+    def test_list_query_count_is_constant(self):
+        Company.objects.create(name='Company 0')
+        Item.objects.create(name='Item 0')
+        small = {url: self.count_queries(url) for url in ('/api/companies/', '/api/items/', '/api/roles/')}
+
+        for i in range(1, 10):
+            company = Company.objects.create(name=f'Company {i}')
+            company.customers.add(self.customer)
+            Item.objects.create(name=f'Item {i}')
+        owner = self.create_user('owner').customer
+        owner.role = Role.objects.get(name=Role.OWNER)
+        owner.save()
+        large = {url: self.count_queries(url) for url in small}
+
+        self.assertEqual(small, large)
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=0)
+class QueryPlanTests(APITestMixin, APITestCase):
+    """Nested serializers are eager-loaded from the serializer's query plan"""
+
+    def setUp(self):
+        self.user = self.authenticate()
+        self.customer = self.user.customer
+
+    def populate(self, customers_per_item):
+        company = Company.objects.create(name=f'Company {customers_per_item}')
+        for i in range(customers_per_item):
+            customer = self.create_user(f'user-{customers_per_item}-{i}').customer
+            customer.companies.add(company)
+            for j in range(3):
+                item, _ = Item.objects.get_or_create(name=f'Item {j}')
+                item.customers.add(customer)
+
+    def test_nested_lists_query_count_is_constant(self):
+        self.populate(1)
+        small = {url: self.count_queries(url) for url in ('/api/items/', '/api/customers/')}
+        self.populate(8)
+        large = {url: self.count_queries(url) for url in small}
+        self.assertEqual(small, large)
+
+    def test_item_customers_detail(self):
+        item = Item.objects.create(name='Widget')
+        item.customers.add(self.customer)
+        response = self.client.get(f'/api/items/{item.id}/')
+        self.assertEqual(response.data['customers_detail'][0]['username'], self.user.username)
+        self.assertEqual(response.data['customers_detail'][0]['role_name'], 'Customer')
+
+
+class PurchasePriceSnapshotTests(APITestMixin, APITestCase):
+    """Purchases store the unit price and total at the time of purchase"""
+
+    def setUp(self):
+        self.user = self.authenticate()
+        self.customer = self.user.customer
+        self.item = Item.objects.create(name='Widget', unit_price=Decimal('2.50'))
+
+    def test_price_is_snapshotted(self):
+        response = self.client.post('/api/purchase-history/', {
+            'customer': self.customer.id, 'item': self.item.id, 'quantity': 4,
+        })
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.data['unit_price'], '2.50')
+        self.assertEqual(response.data['total_price'], '10.00')
+
+        self.item.unit_price = Decimal('9.99')
+        self.item.save()
+        purchase = PurchaseHistory.objects.get(id=response.data['id'])
+        self.assertEqual(purchase.total_price, Decimal('10.00'))
+
+        purchase.quantity = 2
+        purchase.save(update_fields=['quantity'])
+        purchase.refresh_from_db()
+        self.assertEqual(purchase.total_price, Decimal('5.00'))
+
+        purchase.item = Item.objects.create(name='Gadget', unit_price=Decimal('1.00'))
+        purchase.save()
+        self.assertEqual((purchase.unit_price, purchase.total_price), (Decimal('1.00'), Decimal('2.00')))
+
+    def test_order_by_total_price(self):
+        for quantity in (3, 1, 2):
+            PurchaseHistory.objects.create(customer=self.customer, item=self.item, quantity=quantity)
+        response = self.client.get('/api/purchase-history/', {'ordering': '-total_price'})
+        totals = [row['total_price'] for row in response.data['results']]
+        self.assertEqual(totals, ['7.50', '5.00', '2.50'])
+
+
+class PurchaseStatisticsTests(APITestMixin, APITestCase):
+    """Purchase statistics are aggregated in SQL"""
+
+    def setUp(self):
+        self.user = self.authenticate()
+        self.customer = self.user.customer
+        self.widget = Item.objects.create(name='Widget', unit_price=Decimal('2.00'))
+        self.gadget = Item.objects.create(name='Gadget', unit_price=Decimal('5.00'))
+        for item, quantity, date in [
+            (self.widget, 1, datetime(2025, 1, 5, 10, tzinfo=dt_timezone.utc)),
+            (self.widget, 2, datetime(2025, 1, 20, 23, tzinfo=dt_timezone.utc)),
+            (self.gadget, 1, datetime(2025, 2, 1, 9, tzinfo=dt_timezone.utc)),
+        ]:
+            purchase = PurchaseHistory.objects.create(customer=self.customer, item=item, quantity=quantity)
+            PurchaseHistory.objects.filter(pk=purchase.pk).update(purchase_date=date)
+        other = self.create_user('other').customer
+        PurchaseHistory.objects.create(customer=other, item=self.gadget, quantity=10)
+
+    def test_totals(self):
+        response = self.client.get('/api/purchase-history/statistics/')
+        self.assertEqual(response.data, {
+            'total_purchases': 3,
+            'total_spent': '11.00',
+            'average_purchase': '3.67',
+        })
+
+    def test_date_range_and_month_breakdown(self):
+        response = self.client.get('/api/purchase-history/statistics/', {
+            'from': '2025-01-06', 'to': '2025-02-01', 'group_by': 'month',
+        })
+        self.assertEqual(response.data['total_purchases'], 2)
+        self.assertEqual(response.data['total_spent'], '9.00')
+        self.assertEqual(
+            [(str(row['period']), row['purchases'], row['total_spent']) for row in response.data['breakdown']],
+            [('2025-01-01', 1, '4.00'), ('2025-02-01', 1, '5.00')],
+        )
+
+    def test_item_breakdown(self):
+        response = self.client.get('/api/purchase-history/statistics/', {'group_by': 'item'})
+        rows = [(row['item_name'], row['quantity'], row['total_spent']) for row in response.data['breakdown']]
+        self.assertEqual(rows, [('Widget', 3, '6.00'), ('Gadget', 1, '5.00')])
+
+    def test_invalid_parameters(self):
+        response = self.client.get('/api/purchase-history/statistics/', {'group_by': 'year'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/purchase-history/statistics/', {'from': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+
+class MonthlySpendTests(APITestMixin, APITestCase):
+    """The MonthlySpend rollup follows purchase creates, updates and deletes"""
+
+    def setUp(self):
+        self.user = self.authenticate()
+        self.customer = self.user.customer
+        self.widget = Item.objects.create(name='Widget', unit_price=Decimal('2.00'))
+        self.gadget = Item.objects.create(name='Gadget', unit_price=Decimal('5.00'))
+
+    def purchase(self, item, quantity, date):
+        purchase = PurchaseHistory.objects.create(customer=self.customer, item=item, quantity=quantity)
+        # purchase_date is auto_now_add; move it through a regular save
+        purchase.purchase_date = date
+        purchase.save()
+        return purchase
+
+    def rollup(self):
+        return sorted(
+            (row.item.name, str(row.month), row.purchase_count, row.quantity, row.amount)
+            for row in MonthlySpend.objects.select_related('item')
+        )
+
+    def test_rollup_is_maintained(self):
+        january = datetime(2025, 1, 15, tzinfo=dt_timezone.utc)
+        first = self.purchase(self.widget, 1, january)
+        second = self.purchase(self.widget, 2, january)
+        self.assertEqual(self.rollup(), [('Widget', '2025-01-01', 2, 3, Decimal('6.00'))])
+
+        second.item = self.gadget
+        second.save()
+        self.assertEqual(self.rollup(), [
+            ('Gadget', '2025-01-01', 1, 2, Decimal('10.00')),
+            ('Widget', '2025-01-01', 1, 1, Decimal('2.00')),
+        ])
+
+        first.delete()
+        PurchaseHistory.objects.filter(pk=second.pk).delete()
+        self.assertEqual(self.rollup(), [])
+
+    def test_queryset_delete_subtracts_per_rollup_row(self):
+        january = datetime(2025, 1, 15, tzinfo=dt_timezone.utc)
+        self.purchase(self.widget, 1, january)
+        self.purchase(self.widget, 2, january)
+        self.purchase(self.gadget, 1, january)
+        self.purchase(self.gadget, 4, datetime(2025, 3, 1, tzinfo=dt_timezone.utc))
+        PurchaseHistory.objects.filter(quantity__lte=2).delete()
+        self.assertEqual(self.rollup(), [('Gadget', '2025-03-01', 1, 4, Decimal('20.00'))])
+
+    def test_customer_delete_stays_fast(self):
+        def delete_customer(username, purchases):
+            customer = self.create_user(username).customer
+            PurchaseHistory.objects.bulk_create([
+                PurchaseHistory(customer=customer, item=self.widget, unit_price=2, total_price=2)
+                for _ in range(purchases)
+            ])
+            with CaptureQueriesContext(connection) as ctx:
+                customer.user.delete()
+            return len(ctx.captured_queries)
+
+        self.assertEqual(delete_customer('few', 2), delete_customer('many', 50))
+        self.assertFalse(PurchaseHistory.objects.exists())
+
+    def test_rebuild_command_matches_incremental_rollup(self):
+        self.purchase(self.widget, 1, datetime(2025, 1, 15, tzinfo=dt_timezone.utc))
+        self.purchase(self.gadget, 3, datetime(2025, 3, 1, tzinfo=dt_timezone.utc))
+        incremental = self.rollup()
+        MonthlySpend.objects.all().delete()
+        call_command('rebuild_monthly_spend', stdout=StringIO())
+        self.assertEqual(self.rollup(), incremental)
+
+    def test_monthly_endpoint(self):
+        self.purchase(self.widget, 1, datetime(2025, 1, 15, tzinfo=dt_timezone.utc))
+        self.purchase(self.gadget, 1, datetime(2025, 1, 20, tzinfo=dt_timezone.utc))
+        self.purchase(self.gadget, 2, datetime(2025, 3, 1, tzinfo=dt_timezone.utc))
+
+        response = self.client.get('/api/purchase-history/monthly/')
+        self.assertEqual(
+            [(row['month'], row['purchases'], row['quantity'], row['total_spent']) for row in response.data],
+            [('2025-01-01', 2, 2, '7.00'), ('2025-03-01', 1, 2, '10.00')],
+        )
+
+        response = self.client.get('/api/purchase-history/monthly/', {'from': '2025-02', 'item': self.gadget.id})
+        self.assertEqual([row['month'] for row in response.data], ['2025-03-01'])
+
+        response = self.client.get('/api/purchase-history/monthly/', {'from': '2025'})
+        self.assertEqual(response.status_code, 400)
+
+
+class CursorPaginationTests(APITestMixin, APITestCase):
+    """Purchase history supports opt-in cursor pagination"""
+
+    def setUp(self):
+        self.user = self.authenticate()
+        item = Item.objects.create(name='Widget', unit_price=Decimal('1.00'))
+        PurchaseHistory.objects.bulk_create([
+            PurchaseHistory(customer=self.user.customer, item=item, quantity=i + 1, unit_price=1, total_price=i + 1)
+            for i in range(12)
+        ])
+
+    def test_cursor_pages_cover_all_rows_without_count(self):
+        url = '/api/purchase-history/?pagination=cursor&page_size=5'
+        seen = []
+        query_counts = []
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertNotIn('count', response.data)
+            self.assertFalse(any('COUNT(' in q['sql'] for q in ctx.captured_queries))
+            query_counts.append(len(ctx.captured_queries))
+            seen.extend(row['id'] for row in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(len(seen), 12)
+        self.assertEqual(len(set(seen)), 12)
+        self.assertEqual(len(set(query_counts)), 1)
+
+    def test_page_size_is_bounded(self):
+        with mock.patch.object(OptInCursorPagination, 'max_page_size', 5):
+            response = self.client.get('/api/purchase-history/', {'pagination': 'cursor', 'page_size': 1000})
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_page_number_pagination_is_the_default(self):
+        response = self.client.get('/api/purchase-history/', {'page': 2})
+        self.assertEqual(response.data['count'], 12)
+        self.assertEqual(len(response.data['results']), 2)
+
+
+class PurchaseExportTests(APITestMixin, APITestCase):
+    """Purchase history can be streamed as CSV or NDJSON"""
+
+    def setUp(self):
+        self.user = self.authenticate()
+        self.widget = Item.objects.create(name='Widget', unit_price=Decimal('2.00'))
+        self.gadget = Item.objects.create(name='Gadget', unit_price=Decimal('5.00'))
+        PurchaseHistory.objects.create(customer=self.user.customer, item=self.widget, quantity=1)
+        PurchaseHistory.objects.create(customer=self.user.customer, item=self.gadget, quantity=2, notes='a, "b"')
+        other = self.create_user('other').customer
+        PurchaseHistory.objects.create(customer=other, item=self.widget, quantity=3)
+
+    def export(self, **params):
+        response = self.client.get('/api/purchase-history/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv(self):
+        rows = list(csv.DictReader(StringIO(self.export())))
+        self.assertEqual([row['item_name'] for row in rows], ['Gadget', 'Widget'])
+        self.assertEqual(rows[0]['customer_username'], self.user.username)
+        self.assertEqual(rows[0]['total_price'], '10.00')
+        self.assertEqual(rows[0]['notes'], 'a, "b"')
+
+    def test_ndjson_with_filters(self):
+        lines = self.export(output='ndjson', item=self.widget.id).splitlines()
+        self.assertEqual(len(lines), 1)
+        row = json.loads(lines[0])
+        self.assertEqual((row['item_name'], row['quantity'], row['unit_price']), ('Widget', 1, '2.00'))
+
+    def test_staff_sees_all_purchases(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(len(self.export(output='ndjson').splitlines()), 3)
+
+    def test_unknown_output(self):
+        response = self.client.get('/api/purchase-history/export/', {'output': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+
+class PurchaseBulkTests(APITestMixin, APITestCase):
+    """Purchases can be created in bulk with per-row errors"""
+
+    def setUp(self):
+        self.user = self.authenticate()
+        self.user.is_staff = True
+        self.user.save()
+        self.customer = self.user.customer
+        self.item = Item.objects.create(name='Widget', unit_price=Decimal('2.00'))
+
+    def test_json_array_with_row_errors(self):
+        rows = [
+            {'customer': self.customer.id, 'item': self.item.id, 'quantity': 2},
+            {'customer': self.customer.id, 'item': 9999},
+            {'customer': self.customer.id, 'item': self.item.id, 'quantity': 0},
+            'not an object',
+            {'customer': self.customer.id, 'item': self.item.id, 'notes': 'promo'},
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/purchase-history/bulk/', rows, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2, 3])
+        self.assertIn('item', response.data['errors'][0]['errors'])
+        self.assertLess(len(ctx.captured_queries), 15)
+
+        self.assertEqual(
+            sorted(PurchaseHistory.objects.values_list('quantity', 'total_price')),
+            [(1, Decimal('2.00')), (2, Decimal('4.00'))],
+        )
+        rollup = MonthlySpend.objects.get()
+        self.assertEqual((rollup.purchase_count, rollup.quantity, rollup.amount), (2, 3, Decimal('6.00')))
+
+    def test_ndjson(self):
+        body = '\n'.join([
+            json.dumps({'customer': self.customer.id, 'item': self.item.id, 'quantity': 3}),
+            '{broken',
+            '',
+        ])
+        response = self.client.post(
+            '/api/purchase-history/bulk/', body, content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['errors'][0]['index'], 1)
+
+    def test_non_staff_only_for_own_profile(self):
+        self.user.is_staff = False
+        self.user.save()
+        other = self.create_user('other').customer
+        rows = [
+            {'customer': self.customer.id, 'item': self.item.id},
+            {'customer': other.id, 'item': self.item.id},
+        ]
+        response = self.client.post('/api/purchase-history/bulk/', rows, format='json')
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['errors'][0]['index'], 1)
+        self.assertFalse(PurchaseHistory.objects.filter(customer=other).exists())
+
+
+class MembershipBatchTests(APITestMixin, APITestCase):
+    """Batch membership actions diff against the current memberships"""
+
+    def setUp(self):
+        self.user = self.authenticate()
+        self.customer = self.user.customer
+        self.companies = [Company.objects.create(name=f'Company {i}') for i in range(4)]
+        self.customer.companies.add(self.companies[0], self.companies[1])
+
+    def ids(self, *indexes):
+        return [self.companies[i].id for i in indexes]
+
+    def test_set_companies(self):
+        url = f'/api/customers/{self.customer.id}/set_companies/'
+        response = self.client.post(url, {'company_ids': self.ids(1, 2, 3)}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data, {'added': self.ids(2, 3), 'removed': self.ids(0), 'total': 3})
+        self.assertEqual(sorted(self.customer.companies.values_list('id', flat=True)), self.ids(1, 2, 3))
+
+        response = self.client.post(url, {'company_ids': self.ids(1, 0), 'mode': 'remove'}, format='json')
+        self.assertEqual(response.data, {'added': [], 'removed': self.ids(1), 'total': 2})
+
+    def test_query_count_does_not_depend_on_batch_size(self):
+        customers = [self.create_user(f'member-{i}').customer for i in range(20)]
+        item = Item.objects.create(name='Widget')
+        url = f'/api/items/{item.id}/set_customers/'
+
+        with CaptureQueriesContext(connection) as small:
+            self.client.post(url, {'customer_ids': [c.id for c in customers[:2]]}, format='json')
+        with CaptureQueriesContext(connection) as large:
+            self.client.post(url, {'customer_ids': [c.id for c in customers[5:]]}, format='json')
+        self.assertEqual(item.customers.count(), 15)
+        # The second call also removes, which costs one DELETE
+        self.assertLessEqual(len(large.captured_queries), len(small.captured_queries) + 1)
+
+    def test_through_table_is_read_once(self):
+        url = f'/api/customers/{self.customer.id}/set_companies/'
+        company_url = f'/api/companies/{self.companies[0].id}/'
+        self.assertEqual(self.client.get(company_url).data['customer_count'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post(url, {'company_ids': self.ids(1, 2, 3)}, format='json')
+        self.assertEqual(response.data['total'], 3)
+        reads = [q['sql'] for q in ctx.captured_queries
+                 if q['sql'].startswith('SELECT') and 'api_customer_companies' in q['sql']]
+        self.assertEqual(len(reads), 1, reads)
+
+        # m2m_changed is still sent, so the cached company response is dropped
+        self.assertEqual(self.client.get(company_url).data['customer_count'], 0)
+
+    def test_unknown_ids_are_rejected(self):
+        response = self.client.post(
+            f'/api/customers/{self.customer.id}/set_items/', {'item_ids': [9999]}, format='json'
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['item_ids'], [9999])
+
+
+class CachedTokenAuthenticationTests(APITestMixin, APITestCase):
+    """Token lookups are cached and invalidated on logout and deactivation"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = self.create_user('token-user')
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def auth_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/users/')
+        return response, [q['sql'] for q in ctx.captured_queries if 'authtoken_token' in q['sql']]
+
+    def test_second_request_does_not_query_token(self):
+        response, queries = self.auth_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+        response, queries = self.auth_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+
+    def test_logout_invalidates(self):
+        self.auth_queries()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/logout/')
+        self.assertEqual(response.status_code, 200)
+        response, _ = self.auth_queries()
+        self.assertEqual(response.status_code, 401)
+
+    def test_deactivation_invalidates_after_commit(self):
+        self.auth_queries()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+            # Not committed yet: other requests still see the active user
+            self.assertIsNotNone(cache.get(token_cache_key(self.token.key)))
+        response, _ = self.auth_queries()
+        self.assertEqual(response.status_code, 401)
+
+    def test_cache_holds_no_credentials(self):
+        self.auth_queries()
+        cache_key = token_cache_key(self.token.key)
+        self.assertEqual(cache.get(user_token_cache_key(self.user.pk)), cache_key)
+        entry = repr(cache.get(cache_key))
+        self.assertNotIn(self.token.key, entry)
+        self.assertNotIn(self.user.password, entry)
+
+        user, token = CachedTokenAuthentication().authenticate_credentials(self.token.key)
+        self.assertEqual((user.pk, user.username, token.key), (self.user.pk, 'token-user', self.token.key))
+        self.assertEqual(user.get_deferred_fields(), {'password'})
+
+
+class CustomerContextTests(APITestMixin, APITestCase):
+    """The caller's customer profile is loaded once per request"""
+
+    def test_profile_is_loaded_once(self):
+        self.authenticate()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/purchase-history/my_purchases/')
+        self.assertEqual(response.status_code, 200)
+        profile_queries = [q for q in ctx.captured_queries if 'FROM "api_customer"' in q['sql']]
+        self.assertEqual(len(profile_queries), 1)
+
+    def test_user_without_profile(self):
+        user = self.authenticate()
+        user.customer.delete()
+        response = self.client.get('/api/purchase-history/statistics/')
+        self.assertEqual(response.status_code, 404)
+
+
+class ProfileSignalWriteTests(APITestMixin, APITestCase):
+    """Saving or logging in a User does not rewrite its Customer profile"""
+
+    WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE')
+
+    def writes(self, ctx):
+        return [q['sql'] for q in ctx.captured_queries if q['sql'].startswith(self.WRITE_PREFIXES)]
+
+    def test_signup_creates_user_and_profile_only(self):
+        with CaptureQueriesContext(connection) as ctx:
+            user = self.create_user('new-user')
+        writes = self.writes(ctx)
+        self.assertEqual(len(writes), 2, writes)
+        self.assertTrue(writes[0].startswith('INSERT INTO "auth_user"'))
+        self.assertTrue(writes[1].startswith('INSERT INTO "api_customer"'))
+        self.assertEqual(user.customer.role.name, Role.CUSTOMER)
+
+    def test_session_login_only_updates_last_login(self):
+        user = self.create_user('login-user', password='pass1234')
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertTrue(self.client.login(username='login-user', password='pass1234'))
+        writes = self.writes(ctx)
+        self.assertFalse([sql for sql in writes if 'api_customer' in sql], writes)
+        self.assertEqual(len([sql for sql in writes if 'auth_user' in sql]), 1, writes)
+        updated_at = user.customer.updated_at
+        user.customer.refresh_from_db()
+        self.assertEqual(user.customer.updated_at, updated_at)
+
+    def test_api_login_writes_only_the_token(self):
+        self.create_user('api-login', password='pass1234')
+        credentials = {'username': 'api-login', 'password': 'pass1234'}
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/auth/login/', credentials, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.writes(ctx)), 1, self.writes(ctx))
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post('/api/auth/login/', credentials, format='json')
+        self.assertEqual(self.writes(ctx), [])
+
+    def test_missing_profile_is_backfilled(self):
+        user = self.create_user('legacy')
+        Customer.objects.filter(user=user).delete()
+        user.first_name = 'Legacy'
+        user.save()
+        self.assertTrue(Customer.objects.filter(user=user).exists())
+
+
+class RoleCacheTests(APITestMixin, APITestCase):
+    """Roles are served from a process-local registry"""
+
+    def setUp(self):
+        Role.clear_cache()
+
+    def test_signups_do_not_query_roles(self):
+        Role.get_cached(Role.CUSTOMER)
+        with CaptureQueriesContext(connection) as ctx:
+            self.create_user('first')
+            self.create_user('second')
+        self.assertFalse([q for q in ctx.captured_queries if 'FROM "api_role"' in q['sql']])
+
+    def test_registry_is_invalidated_on_save(self):
+        role = Role.get_cached(Role.MANAGER)
+        role_copy = Role.objects.get(pk=role.pk)
+        role_copy.description = 'Updated'
+        role_copy.save()
+        self.assertEqual(Role.get_cached(Role.MANAGER).description, 'Updated')
+        self.assertEqual(Role.get_cached_by_id(role.pk).description, 'Updated')
+
+    def test_create_customer_through_api(self):
+        self.authenticate()
+        manager = Role.get_cached(Role.MANAGER)
+        company = Company.objects.create(name='Acme')
+        response = self.client.post('/api/customers/', {
+            'username': 'created', 'password': 'pass1234', 'email': 'created@example.com',
+            'phone': '010', 'role_id': manager.id, 'company_ids': [company.id],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        customer = Customer.objects.get(user__username='created')
+        self.assertEqual((customer.role_id, customer.phone), (manager.id, '010'))
+        self.assertEqual(list(customer.companies.all()), [company])
+
+
+class ImportCustomersCommandTests(APITestMixin, APITestCase):
+    """manage.py import_customers bulk-creates users, profiles and memberships"""
+
+    def setUp(self):
+        self.company = Company.objects.create(name='Acme')
+        self.create_user('taken')
+
+    def run_import(self, content, suffix, *args):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False) as handle:
+            handle.write(content)
+        self.addCleanup(os.remove, handle.name)
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_customers', handle.name, *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_import_csv(self):
+        content = (
+            'username,email,password,role,companies,date_of_birth\n'
+            f'alice,alice@example.com,secret123,manager,{self.company.id},1990-01-02\n'
+            'bob,bob@example.com,,,,\n'
+            'taken,taken@example.com,,,,\n'
+            'carol,,,admin,,\n'
+        )
+        stdout, stderr = self.run_import(content, '.csv', '--workers', '1', '--batch-size', '2')
+
+        alice = Customer.objects.select_related('user', 'role').get(user__username='alice')
+        self.assertEqual(alice.role.name, Role.MANAGER)
+        self.assertEqual(str(alice.date_of_birth), '1990-01-02')
+        self.assertTrue(alice.user.check_password('secret123'))
+        self.assertEqual(list(alice.companies.all()), [self.company])
+        bob = Customer.objects.select_related('user', 'role').get(user__username='bob')
+        self.assertEqual(bob.role.name, Role.CUSTOMER)
+        self.assertFalse(bob.user.has_usable_password())
+
+        self.assertFalse(User.objects.filter(username='carol').exists())
+        self.assertIn("Row 3: user 'taken' already exists", stderr)
+        self.assertIn("Row 4: unknown role 'admin'", stderr)
+        self.assertIn('Imported 2 customers, skipped 2 rows', stdout)
+
+    def test_import_ndjson_with_process_pool(self):
+        content = '\n'.join([
+            json.dumps({'username': 'dave', 'password': 'pw-dave', 'companies': [self.company.id]}),
+            'not json',
+            json.dumps({'username': 'erin', 'companies': [999]}),
+        ])
+        stdout, stderr = self.run_import(content, '.ndjson', '--workers', '2')
+
+        dave = User.objects.get(username='dave')
+        self.assertTrue(dave.check_password('pw-dave'))
+        self.assertEqual(list(dave.customer.companies.all()), [self.company])
+        self.assertIn('Row 2: not a JSON object', stderr)
+        self.assertIn('Row 3: unknown companies [999]', stderr)
+        self.assertIn('Imported 1 customers, skipped 2 rows', stdout)
+
+    def test_ndjson_rows_with_wrong_types_are_skipped(self):
+        content = '\n'.join(json.dumps(row) for row in [
+            {'username': 123},
+            {'username': 'frank', 'role': ['owner']},
+            {'username': 'gina', 'bio': {'text': 'hi'}},
+            {'username': 'hank', 'companies': str(self.company.id)},
+            {'username': 'ivy', 'companies': [[self.company.id]]},
+            {'username': 'judy', 'email': 'judy@example.com'},
+        ])
+        stdout, stderr = self.run_import(content, '.ndjson', '--workers', '1')
+
+        self.assertEqual(list(User.objects.filter(username__in=['frank', 'gina', 'hank', 'ivy', 'judy'])
+                              .values_list('username', flat=True)), ['judy'])
+        self.assertIn('Row 1: username must be text', stderr)
+        self.assertIn('Row 2: role must be text', stderr)
+        self.assertIn('Row 3: bio must be text', stderr)
+        self.assertIn('Row 4: companies must be a list of company IDs', stderr)
+        self.assertIn('Row 5: company IDs must be integers', stderr)
+        self.assertIn('Imported 1 customers, skipped 5 rows', stdout)
+
+
+class SeedBenchTests(APITestMixin, APITestCase):
+    """seed_bench builds a deterministic, skewed dataset the benchmarks can run on"""
+
+    def seed(self, **options):
+        call_command(
+            'seed_bench', companies=3, customers=20, items=10, purchases=300,
+            end_date='2025-06-30', stdout=StringIO(), **options
+        )
+        return list(
+            PurchaseHistory.objects.order_by('purchase_date', 'customer__user__username')
+            .values_list('customer__user__username', 'item__name', 'quantity', 'purchase_date')
+        )
+
+    def test_dataset_is_deterministic_and_skewed(self):
+        first = self.seed()
+        self.assertEqual(first, self.seed(clear=True))
+        self.assertEqual(Customer.objects.filter(user__username__startswith='bench-').count(), 20)
+        self.assertEqual(MonthlySpend.objects.aggregate(total=Sum('purchase_count'))['total'], 300)
+
+        top = Counter(username for username, *_ in first).most_common(1)[0][1]
+        self.assertGreater(top, 300 / 20 * 2)
+
+    def test_benchmark_routes(self):
+        self.seed()
+        self.authenticate()
+        detail_pks = {'company': Company.objects.first().pk, 'item': Item.objects.first().pk}
+        routes = dict(collect_routes(detail_pks))
+        self.assertEqual(routes['api:item-customers'], f"/api/items/{detail_pks['item']}/customers/")
+        self.assertEqual(routes['console:company_detail'], f"/companies/{detail_pks['company']}/")
+        self.assertNotIn('api:customer-detail', routes)
+
+        result = measure_route(self.client, routes['api:purchase-history-export'], repeat=2)
+        self.assertEqual(result['status'], 200)
+        self.assertEqual(set(result), {'status', 'p50_ms', 'p95_ms', 'queries', 'peak_memory_kb'})
+
+
+# Maximum number of queries per GET route (see collect_routes), measured
+# with caches warm and without conditional request headers. Budgets must
+# not depend on page size or on how many related rows an object has:
+# QueryBudgetTests checks each route against a small and a larger dataset
+# and requires the same count for both.
+QUERY_BUDGETS = {
+    'api:role-list': 3,
+    'api:role-detail': 2,
+    'api:role-customers': 4,
+    'api:company-list': 3,
+    'api:company-detail': 2,
+    'api:company-customers': 5,
+    'api:customer-list': 6,
+    'api:customer-detail': 5,
+    'api:item-list': 4,
+    'api:item-detail': 3,
+    'api:item-customers': 3,
+    'api:user-list': 2,
+    'api:user-detail': 1,
+    'api:purchase-history-list': 3,
+    'api:purchase-history-detail': 2,
+    'api:purchase-history-export': 1,
+    'api:purchase-history-monthly': 2,
+    'api:purchase-history-my-purchases': 3,
+    'api:purchase-history-statistics': 2,
+    'console:home': 2,
+    'console:dashboard': 4,
+    'console:customer_list': 8,
+    'console:company_list': 5,
+    'console:company_detail': 4,
+    'console:purchase_list': 5,
+}
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=0)
+class QueryBudgetTests(APITestMixin, APITestCase):
+    """Every API route and console page stays within its query budget"""
+
+    def seed(self, scale):
+        call_command(
+            'seed_bench', companies=2 * scale, customers=10 * scale, items=5 * scale,
+            purchases=60 * scale, end_date='2025-06-30', clear=True, stdout=StringIO()
+        )
+        # The whale customer of the largest company sees (almost) everything
+        customer = Customer.objects.select_related('user').get(user__username='bench-000001')
+        customer.user.is_staff = True
+        customer.user.save()
+        customer.role = Role.get_cached(Role.OWNER)
+        customer.save()
+        customer.companies.set(Company.objects.all())
+        self.client.force_login(customer.user)
+        self.client.force_authenticate(customer.user)
+        detail_pks = {
+            'role': customer.role_id,
+            'company': Company.objects.get(name='bench Company 0001').pk,
+            'customer': customer.pk,
+            'item': Item.objects.get(name='bench Item 0001').pk,
+            'user': customer.user_id,
+            'purchase-history': customer.purchase_history.values_list('pk', flat=True).first(),
+        }
+        return collect_routes(detail_pks)
+
+    def measure(self, scale):
+        counts = {}
+        for name, url in self.seed(scale):
+            self.client.get(url)  # warm up process-local caches
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            self.assertEqual(response.status_code, 200, f'{name}: {url}')
+            counts[name] = len(ctx.captured_queries)
+        return counts
+
+    def test_query_budgets(self):
+        small = self.measure(1)
+        large = self.measure(4)
+        self.assertEqual(set(small), set(QUERY_BUDGETS), 'Declare a budget for every route')
+        for name, budget in QUERY_BUDGETS.items():
+            with self.subTest(route=name):
+                self.assertEqual(large[name], small[name], 'Query count depends on the data size (N+1)')
+                self.assertLessEqual(large[name], budget)
+
+
+class ServerTimingTests(APITestMixin, APITestCase):
+    """ServerTimingMiddleware reports DB, serializer and template time"""
+
+    def parse(self, response):
+        metrics = {}
+        for entry in response['Server-Timing'].split(', '):
+            name, *params = entry.split(';')
+            metrics[name] = dict(param.split('=', 1) for param in params)
+        return metrics
+
+    def test_api_request(self):
+        self.authenticate()
+        Company.objects.create(name='Acme')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/companies/')
+        metrics = self.parse(response)
+        self.assertEqual(metrics['db']['desc'], f'"{len(ctx.captured_queries)} queries"')
+        self.assertGreater(float(metrics['serialize']['dur']), 0)
+        self.assertEqual(float(metrics['render']['dur']), 0)
+        self.assertGreaterEqual(float(metrics['total']['dur']), float(metrics['db']['dur']))
+
+    def test_console_page(self):
+        self.client.force_login(self.create_user('web-user'))
+        metrics = self.parse(self.client.get('/dashboard/'))
+        self.assertGreater(float(metrics['render']['dur']), 0)
+        self.assertEqual(float(metrics['serialize']['dur']), 0)
+
+    @override_settings(SERVER_TIMING_LOG=True)
+    def test_log_line(self):
+        with self.assertLogs('api.timing', 'INFO') as logs:
+            self.client.get('/')
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual((entry['path'], entry['status']), ('/', 200))
+        self.assertEqual(
+            set(entry),
+            {'method', 'path', 'status', 'db_queries', 'db_ms', 'serialize_ms', 'render_ms', 'total_ms'},
+        )
+
+
+class ProfilingTests(APITestMixin, APITestCase):
+    """Staff can profile any request; sampling writes profiles to a rotating directory"""
+
+    def setUp(self):
+        self.staff = self.create_user('staff', is_staff=True)
+        self.token = Token.objects.create(user=self.staff)
+        Company.objects.create(name='Acme')
+
+    def test_staff_gets_report(self):
+        response = self.client.get(
+            '/api/companies/', {'_profile': '1'}, HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+        self.assertEqual(response['Content-Type'], 'application/json')
+        report = response.json()
+        self.assertEqual((report['path'], report['status']), ('/api/companies/?_profile=1', 200))
+        self.assertTrue(any('"api_company"' in query['sql'] for query in report['queries']))
+        self.assertTrue(report['functions'])
+
+    def test_pstats_download_from_console(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/dashboard/', HTTP_X_PROFILE='pstats')
+        with tempfile.NamedTemporaryFile(suffix='.prof') as handle:
+            handle.write(response.content)
+            handle.flush()
+            self.assertTrue(pstats.Stats(handle.name).total_calls)
+
+    def test_ignored_for_non_staff(self):
+        self.authenticate()
+        response = self.client.get('/api/companies/', {'_profile': '1'})
+        self.assertIn('results', response.json())
+
+    def test_sampling_keeps_newest_profiles(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.authenticate()
+        with self.settings(PROFILE_SAMPLE_RATE=2, PROFILE_DIR=directory, PROFILE_KEEP=2):
+            for _ in range(6):
+                self.assertEqual(self.client.get('/api/companies/').status_code, 200)
+        self.assertEqual(len(list(Path(directory).glob('*.prof'))), 2)
+        report = json.loads(sorted(Path(directory).glob('*.json'))[-1].read_text())
+        self.assertEqual(report['path'], '/api/companies/')
+
+    def test_busy_profiler_serves_request_unprofiled(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.authenticate()
+        with mock.patch('api.profiling._profiler_lock') as lock:
+            lock.acquire.return_value = False
+            with self.settings(PROFILE_SAMPLE_RATE=1, PROFILE_DIR=directory):
+                response = self.client.get('/api/companies/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(list(Path(directory).iterdir()), [])
+
+            self.authenticate(self.staff)
+            response = self.client.get('/api/companies/', {'_profile': '1'})
+            self.assertEqual(response.status_code, 503)
+
+    def test_profiler_conflict_serves_request_unprofiled(self):
+        self.authenticate()
+        with mock.patch('cProfile.Profile.enable', side_effect=ValueError('Another profiling tool is already active')):
+            with self.settings(PROFILE_SAMPLE_RATE=1):
+                response = self.client.get('/api/companies/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_write_failure_does_not_fail_request(self):
+        self.authenticate()
+        with mock.patch('api.profiling.RequestProfile.write', side_effect=OSError('disk full')):
+            with self.settings(PROFILE_SAMPLE_RATE=1), self.assertLogs('api.middleware', 'ERROR'):
+                response = self.client.get('/api/companies/')
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=0)
+class ConditionalGetTests(APITestMixin, APITestCase):
+    """Router viewsets answer conditional GETs with 304 before serializing"""
+
+    def setUp(self):
+        self.authenticate()
+        self.company = Company.objects.create(name='Acme')
+        self.member = self.create_user('member').customer
+        self.member.companies.add(self.company)
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_detail_not_modified_without_serializing(self):
+        url = f'/api/companies/{self.company.id}/'
+        response = self.client.get(url)
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(1):
+            not_modified = self.revalidate(url, response)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.company.phone = '010'
+            self.company.save()
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_if_modified_since(self):
+        url = f'/api/customers/{self.member.id}/'
+        response = self.client.get(url)
+        not_modified = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_list_changes_with_membership_and_deletion(self):
+        url = '/api/companies/'
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other = self.create_user('other').customer
+            other.companies.add(self.company)
+        response = self.revalidate(url, response)
+        self.assertEqual(response.data['results'][0]['customer_count'], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.user.delete()
+        response = self.revalidate(url, response)
+        self.assertEqual(response.data['results'][0]['customer_count'], 1)
+
+    def test_validators_depend_on_url(self):
+        first = self.client.get('/api/customers/')
+        second = self.client.get('/api/customers/', {'page': 1})
+        self.assertNotEqual(first['ETag'], second['ETag'])
+        self.assertEqual(self.client.get('/api/customers/404404/').status_code, 404)
+
+    def test_cursor_pages_have_no_validators(self):
+        response = self.client.get('/api/purchase-history/', {'pagination': 'cursor'})
+        self.assertNotIn('ETag', response)
+
+    def test_user_changes_are_not_modified(self):
+        url = f'/api/customers/{self.member.id}/'
+        response = self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.member.user.email = 'member@example.com'
+            self.member.user.save()
+        response = self.revalidate(url, response)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['email'], 'member@example.com')
+
+    def test_validators_do_not_scan_dependency_tables(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(f'/api/customers/{self.member.id}/')
+        self.assertFalse(any('api_customer_companies' in query['sql'] and 'MAX(' in query['sql']
+                             for query in ctx.captured_queries))
+
+    def test_empty_querysets(self):
+        # Without a Customer profile, purchase history is .none()
+        user = self.create_user('no-profile')
+        user.customer.delete()
+        self.authenticate(User.objects.get(pk=user.pk))
+        response = self.client.get('/api/purchase-history/')
+        self.assertEqual((response.status_code, response.data['count']), (200, 0))
+        self.assertEqual(self.client.get('/api/purchase-history/1/').status_code, 404)
+
+    def test_malformed_lookup_is_not_found(self):
+        self.assertEqual(self.client.get('/api/companies/abc/').status_code, 404)
+        self.assertEqual(self.client.get('/api/customers/abc/').status_code, 404)
+
+
+class ResponseCacheTests(APITestMixin, APITestCase):
+    """Roles, companies and items are served from the response cache until they change"""
+
+    def setUp(self):
+        self.user = self.authenticate()
+        self.company = Company.objects.create(name='Acme')
+        self.item = Item.objects.create(name='Widget', unit_price=Decimal('5.00'))
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response, len(ctx.captured_queries)
+
+    def test_hit_needs_no_queries(self):
+        url = f'/api/items/{self.item.id}/'
+        miss, _ = self.get(url)
+        self.assertEqual(miss['X-Cache'], 'MISS')
+        hit, queries = self.get(url)
+        self.assertEqual(hit['X-Cache'], 'HIT')
+        self.assertEqual(queries, 0)
+        self.assertEqual(hit.data, miss.data)
+        self.assertEqual(hit['ETag'], miss['ETag'])
+
+    def test_keyed_by_query_params_and_scope(self):
+        self.get('/api/companies/')
+        response, _ = self.get('/api/companies/', search='Acme')
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+        self.user.is_staff = True
+        self.user.save()
+        response, _ = self.get('/api/companies/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+    def test_invalidated_by_save_and_delete(self):
+        url = '/api/companies/'
+        self.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.company.name = 'Acme Corp'
+            self.company.save()
+        response, _ = self.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['name'], 'Acme Corp')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.company.delete()
+        response, _ = self.get(url)
+        self.assertEqual(response.data['count'], 0)
+
+    def test_invalidated_by_membership_change(self):
+        url = f'/api/companies/{self.company.id}/'
+        self.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.customer.companies.add(self.company)
+        response, _ = self.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['customer_count'], 1)
+
+    def test_invalidated_by_customer_role_change(self):
+        url = '/api/roles/'
+        self.get(url)
+        customer = self.user.customer
+        with self.captureOnCommitCallbacks(execute=True):
+            customer.role = Role.get_cached(Role.OWNER)
+            customer.save()
+        response, _ = self.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+    def test_invalidated_after_commit(self):
+        url = f'/api/companies/{self.company.id}/'
+        self.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.customer.companies.add(self.company)
+            # A request before the commit must not cache under the new version
+            response, _ = self.get(url)
+            self.assertEqual(response['X-Cache'], 'HIT')
+        response, _ = self.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+    def test_unrelated_changes_keep_entries(self):
+        self.get('/api/roles/')
+        self.item.name = 'Gadget'
+        self.item.save()
+        self.user.last_login = self.item.updated_at
+        self.user.save(update_fields=['last_login'])
+        response, _ = self.get('/api/roles/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+    def test_hit_answers_not_modified(self):
+        url = f'/api/items/{self.item.id}/'
+        response, _ = self.get(url)
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    @override_settings(RESPONSE_CACHE_TIMEOUT=0)
+    def test_disabled(self):
+        self.get('/api/items/')
+        response, _ = self.get('/api/items/')
+        self.assertNotIn('X-Cache', response)
+
+    def test_stats(self):
+        self.get('/api/items/')
+        self.get('/api/items/')
+        self.get('/api/items/')
+        self.assertEqual(self.client.get('/api/cache-stats/').status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        stats = self.client.get('/api/cache-stats/').data
+        self.assertEqual(stats['items'], {'hits': 2, 'misses': 1, 'hit_rate': 0.6667})
+        self.assertIsNone(stats['roles']['hit_rate'])
+
+
+@override_settings(RESPONSE_CACHE_TIMEOUT=0)
+class SparseFieldsetTests(APITestMixin, APITestCase):
+    """?fields= and ?expand= shrink both the payload and the queries"""
+
+    def setUp(self):
+        self.authenticate()
+        self.customer = self.create_user('member', first_name='Ann').customer
+        self.customer.bio = 'A long biography'
+        self.customer.save()
+        self.company = Company.objects.create(name='Acme', description='Makes everything')
+        self.customer.companies.add(self.company)
+        Item.objects.create(name='Widget').customers.add(self.customer)
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response, [query['sql'] for query in ctx.captured_queries]
+
+    def member(self, response):
+        return next(row for row in response.data['results'] if row['id'] == self.customer.id)
+
+    def test_fields(self):
+        full, full_queries = self.get('/api/customers/')
+        sparse, sparse_queries = self.get('/api/customers/', fields='id,username,phone')
+        self.assertEqual(set(self.member(sparse)), {'id', 'username', 'phone'})
+        self.assertLess(len(sparse_queries), len(full_queries))
+        self.assertFalse(any('"bio"' in sql for sql in sparse_queries))
+
+    def test_expand(self):
+        response, _ = self.get(f'/api/customers/{self.customer.id}/', expand='role_detail')
+        self.assertEqual(response.data['role_detail']['name'], Role.CUSTOMER)
+        self.assertEqual(response.data['bio'], 'A long biography')
+        self.assertNotIn('companies_detail', response.data)
+        self.assertNotIn('items_detail', response.data)
+
+        response, _ = self.get(f'/api/customers/{self.customer.id}/', expand='')
+        self.assertNotIn('role_detail', response.data)
+        self.assertIn('username', response.data)
+
+    def test_nested_fields(self):
+        response, queries = self.get(f'/api/customers/{self.customer.id}/', fields='username,companies_detail.name')
+        self.assertEqual(response.data, {'username': 'member', 'companies_detail': [{'name': 'Acme'}]})
+        self.assertFalse(any('customer_count' in sql or '"description"' in sql for sql in queries))
+
+    def test_unknown_fields(self):
+        for params in ({'fields': 'id,secret'}, {'fields': 'username.first'}, {'expand': 'phone'}):
+            with self.subTest(**params):
+                response = self.client.get('/api/customers/', params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.data)
+
+    def test_property_fields_load_their_relations(self):
+        _, few = self.get('/api/customers/', fields='id,full_name')
+        _, nested_few = self.get('/api/items/', fields='customers_detail.full_name')
+        item = Item.objects.get()
+        for index in range(5):
+            item.customers.add(self.create_user(f'extra-{index}').customer)
+        response, many = self.get('/api/customers/', fields='id,full_name')
+        self.assertEqual(len(many), len(few))
+        self.assertEqual(self.member(response)['full_name'], 'Ann')
+        _, nested_many = self.get('/api/items/', fields='customers_detail.full_name')
+        self.assertEqual(len(nested_many), len(nested_few))
+
+    def test_selections_are_not_cached(self):
+        self.get('/api/customers/')
+        size = _full_query_plan.cache_info().currsize
+        for fields in ('id', 'id,phone', 'username,bio', 'companies_detail.name'):
+            self.get('/api/customers/', fields=fields)
+        self.assertEqual(_full_query_plan.cache_info().currsize, size)
+
+    def test_users(self):
+        response, _ = self.get('/api/users/', fields='id')
+        self.assertEqual(set(response.data['results'][0]), {'id'})
+        self.assertEqual(self.client.get('/api/users/', {'fields': 'password'}).status_code, 400)
+
+    def test_writes_ignore_selection(self):
+        response = self.client.patch(
+            f'/api/companies/{self.company.id}/?fields=id', {'phone': '010'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['description'], 'Makes everything')
+        response, _ = self.get(f'/api/companies/{self.company.id}/', fields='id,description')
+        self.assertEqual(response.data, {'id': self.company.id, 'description': 'Makes everything'})
@@ -0,0 +1,106 @@
+"""
+Per-request timing of database queries, serialization and template rendering.
+
+ServerTimingMiddleware (api.middleware) activates a RequestTimings for each
+request; while it is active, every query run through a database execute
+wrapper, every top-level serializer ``.data`` evaluation and every template
+render adds its duration to it. Outside a request (shell, management
+commands) the hooks only check a context variable and call through.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_current = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    """Accumulated durations (in seconds) of one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.render = 0.0
+        # Serializers and templates can nest; only the outermost one is timed
+        self._depth = {'serialize': 0, 'render': 0}
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def as_dict(self):
+        """Durations in milliseconds, for logging"""
+        return {
+            'db_queries': self.db_queries,
+            'db_ms': round(self.db * 1000, 2),
+            'serialize_ms': round(self.serialize * 1000, 2),
+            'render_ms': round(self.render * 1000, 2),
+            'total_ms': round(self.total * 1000, 2),
+        }
+
+    def header(self):
+        """The value of the Server-Timing response header"""
+        return ', '.join([
+            f'db;dur={self.db * 1000:.2f};desc="{self.db_queries} queries"',
+            f'serialize;dur={self.serialize * 1000:.2f}',
+            f'render;dur={self.render * 1000:.2f}',
+            f'total;dur={self.total * 1000:.2f}',
+        ])
+
+
+@contextmanager
+def track_request():
+    """Make a new RequestTimings the current one for the duration of the block"""
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper that times each query"""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db += time.perf_counter() - start
+        timings.db_queries += 1
+
+
+def _timed(section, func):
+    def wrapper(*args, **kwargs):
+        timings = _current.get()
+        if timings is None:
+            return func(*args, **kwargs)
+        timings._depth[section] += 1
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings._depth[section] -= 1
+            if not timings._depth[section]:
+                setattr(timings, section, getattr(timings, section) + time.perf_counter() - start)
+    wrapper.__wrapped__ = func
+    return wrapper
+
+
+def install():
+    """
+    Wrap DRF's ``BaseSerializer.data`` and the Django template backend's
+    ``render``. Called once from ApiConfig.ready().
+    """
+    from django.template.backends.django import Template
+    from rest_framework.serializers import BaseSerializer
+
+    if hasattr(Template.render, '__wrapped__'):
+        return
+    Template.render = _timed('render', Template.render)
+    data = BaseSerializer.data
+    BaseSerializer.data = property(_timed('serialize', data.fget), doc=data.__doc__)
@@ -16,6 +16,9 @@ urlpatterns = [
     path('auth/login/', views.login_view, name='login'),
     path('auth/logout/', views.logout_view, name='logout'),
     
+    # Monitoring
+    path('cache-stats/', views.response_cache_stats, name='response-cache-stats'),
+    
     # API endpoints
     path('', include(router.urls)),
 ]
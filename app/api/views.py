@@ -1,11 +1,31 @@
-from rest_framework import viewsets, permissions, status
+from datetime import datetime
+from decimal import Decimal
+
+from rest_framework import viewsets, permissions, status, filters, exceptions
 from rest_framework.decorators import api_view, permission_classes, action
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F, Sum
+from django.http import StreamingHttpResponse
+from django_filters.rest_framework import DjangoFilterBackend
+from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema, OpenApiExample
-from .models import Role, Item, Company, Customer, PurchaseHistory
+from .conditional import ConditionalGetMixin
+from .context import get_customer_context
+from .exports import EXPORT_FORMATS, stream_csv, stream_ndjson
+from .memberships import sync_related_ids
+from .fieldsets import parse_fields, prune_serializer, select_fields
+from .filters import PurchaseHistoryFilter
+from .pagination import OptInCursorPagination
+from .parsers import NDJSONParser
+from . import response_cache
+from .response_cache import ResponseCacheMixin
+from .models import Role, Item, Company, Customer, PurchaseHistory, PurchaseHistoryQuerySet, MonthlySpend
+from .query_plan import plan_queryset
 from .serializers import (
     RoleSerializer,
     ItemSerializer, 
@@ -16,11 +36,84 @@ from .serializers import (
     CompanySerializer,
     CustomerSerializer,
     CustomerCreateSerializer,
-    PurchaseHistorySerializer
+    CustomerSummarySerializer,
+    CompanyIdsBatchSerializer,
+    ItemIdsBatchSerializer,
+    CustomerIdsBatchSerializer,
+    MembershipChangeSerializer,
+    PurchaseHistorySerializer,
+    PurchaseHistoryBulkRowSerializer,
+    PurchaseHistoryBulkResponseSerializer,
+    MonthlySpendSerializer
 )
 
 
-class RoleViewSet(viewsets.ReadOnlyModelViewSet):
+def apply_membership_batch(request, manager, related_model, serializer_class, ids_field):
+    """
+    Validate a batch membership request and apply it with ``sync_related_ids``.
+    All IDs are checked with a single IN query; unknown IDs reject the request.
+    """
+    serializer = serializer_class(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    ids = set(serializer.validated_data[ids_field])
+    
+    missing = ids - set(related_model.objects.filter(pk__in=ids).values_list('pk', flat=True))
+    if missing:
+        return Response(
+            {'error': f'{related_model._meta.verbose_name.capitalize()} not found', ids_field: sorted(missing)},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    added, removed, total = sync_related_ids(manager, ids, serializer.validated_data['mode'])
+    return Response({
+        'added': added,
+        'removed': removed,
+        'total': total,
+    })
+
+
+class QueryPlanMixin:
+    """
+    Eager-load everything the viewset's serializer reads.
+    The select_related/prefetch_related plan is derived from the serializer's
+    declared fields by ``api.query_plan.plan_queryset``.
+    
+    GET list/retrieve accept ``?fields=`` and ``?expand=`` (see
+    ``api.fieldsets``); the serializer and the query plan then only cover
+    the selected fields.
+    """
+    
+    # Actions that only need the bare object (e.g. membership updates)
+    unplanned_actions = ()
+    # Actions that accept ?fields= and ?expand=
+    sparse_actions = ('list', 'retrieve')
+    
+    def get_field_selection(self):
+        """The field selection of this request, or None for every field"""
+        if not hasattr(self, '_field_selection'):
+            self._field_selection = None
+            request = getattr(self, 'request', None)
+            if request is not None and request.method in ('GET', 'HEAD') and self.action in self.sparse_actions:
+                params = request.query_params
+                fields = parse_fields(params['fields']) if 'fields' in params else None
+                expand = set(parse_fields(params['expand'])) if 'expand' in params else None
+                try:
+                    self._field_selection = select_fields(self.get_serializer_class()(), fields, expand)
+                except ValueError as exc:
+                    raise exceptions.ParseError({'error': str(exc)})
+        return self._field_selection
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in self.unplanned_actions:
+            return queryset
+        return plan_queryset(queryset, self.get_serializer_class(), self.get_field_selection())
+    
+    def get_serializer(self, *args, **kwargs):
+        return prune_serializer(super().get_serializer(*args, **kwargs), self.get_field_selection())
+
+
+class RoleViewSet(ResponseCacheMixin, ConditionalGetMixin, QueryPlanMixin, viewsets.ReadOnlyModelViewSet):
     """
     API endpoint for viewing roles.
     Supports GET operations only (roles are predefined).
@@ -28,17 +121,19 @@ class RoleViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Role.objects.all()
     serializer_class = RoleSerializer
     permission_classes = [permissions.IsAuthenticated]
+    conditional_namespace = 'roles'
+    response_cache_namespace = 'roles'
     
     @action(detail=True, methods=['get'])
     def customers(self, request, pk=None):
         """Get all customers with this role"""
         role = self.get_object()
-        customers = role.customers.all()
+        customers = plan_queryset(role.customers.all(), CustomerSerializer)
         serializer = CustomerSerializer(customers, many=True)
         return Response(serializer.data)
 
 
-class CompanyViewSet(viewsets.ModelViewSet):
+class CompanyViewSet(ResponseCacheMixin, ConditionalGetMixin, QueryPlanMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing companies.
     Supports GET, POST, PUT, PATCH, DELETE operations.
@@ -46,23 +141,27 @@ class CompanyViewSet(viewsets.ModelViewSet):
     queryset = Company.objects.all()
     serializer_class = CompanySerializer
     permission_classes = [permissions.IsAuthenticated]
+    conditional_namespace = 'companies'
+    response_cache_namespace = 'companies'
     
     @action(detail=True, methods=['get'])
     def customers(self, request, pk=None):
         """Get all customers associated with this company"""
         company = self.get_object()
-        customers = company.customers.all()
+        customers = plan_queryset(company.customers.all(), CustomerSerializer)
         serializer = CustomerSerializer(customers, many=True)
         return Response(serializer.data)
 
 
-class CustomerViewSet(viewsets.ModelViewSet):
+class CustomerViewSet(ConditionalGetMixin, QueryPlanMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing customers.
     Supports GET, POST, PUT, PATCH, DELETE operations.
     """
-    queryset = Customer.objects.select_related('user').prefetch_related('companies').all()
+    queryset = Customer.objects.all()
     permission_classes = [permissions.IsAuthenticated]
+    conditional_namespace = 'customers'
+    unplanned_actions = ['add_company', 'remove_company', 'add_item', 'remove_item', 'set_companies', 'set_items']
     
     def get_serializer_class(self):
         """Use different serializer for creation"""
@@ -133,23 +232,45 @@ class CustomerViewSet(viewsets.ModelViewSet):
                 {'error': 'Item not found'},
                 status=status.HTTP_404_NOT_FOUND
             )
+    
+    @extend_schema(request=CompanyIdsBatchSerializer, responses=MembershipChangeSerializer)
+    @action(detail=True, methods=['post'])
+    def set_companies(self, request, pk=None):
+        """
+        Add, remove or replace this customer's companies in one call.
+        Body: {"company_ids": [...], "mode": "set" | "add" | "remove"}
+        """
+        customer = self.get_object()
+        return apply_membership_batch(request, customer.companies, Company, CompanyIdsBatchSerializer, 'company_ids')
+    
+    @extend_schema(request=ItemIdsBatchSerializer, responses=MembershipChangeSerializer)
+    @action(detail=True, methods=['post'])
+    def set_items(self, request, pk=None):
+        """
+        Add, remove or replace this customer's items in one call.
+        Body: {"item_ids": [...], "mode": "set" | "add" | "remove"}
+        """
+        customer = self.get_object()
+        return apply_membership_batch(request, customer.items, Item, ItemIdsBatchSerializer, 'item_ids')
 
 
-class ItemViewSet(viewsets.ModelViewSet):
+class ItemViewSet(ResponseCacheMixin, ConditionalGetMixin, QueryPlanMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing items.
     Supports GET, POST, PUT, PATCH, DELETE operations.
     """
-    queryset = Item.objects.prefetch_related('customers').all()
+    queryset = Item.objects.all()
     serializer_class = ItemSerializer
     permission_classes = [permissions.IsAuthenticated]
+    conditional_namespace = 'items'
+    response_cache_namespace = 'items'
+    unplanned_actions = ['add_customer', 'remove_customer', 'set_customers']
     
     @action(detail=True, methods=['get'])
     def customers(self, request, pk=None):
         """Get all customers associated with this item"""
         item = self.get_object()
-        customers = item.customers.all()
-        from .serializers import CustomerSummarySerializer
+        customers = plan_queryset(item.customers.all(), CustomerSummarySerializer)
         serializer = CustomerSummarySerializer(customers, many=True)
         return Response(serializer.data)
     
@@ -184,9 +305,19 @@ class ItemViewSet(viewsets.ModelViewSet):
                 {'error': 'Customer not found'},
                 status=status.HTTP_404_NOT_FOUND
             )
+    
+    @extend_schema(request=CustomerIdsBatchSerializer, responses=MembershipChangeSerializer)
+    @action(detail=True, methods=['post'])
+    def set_customers(self, request, pk=None):
+        """
+        Add, remove or replace this item's customers in one call.
+        Body: {"customer_ids": [...], "mode": "set" | "add" | "remove"}
+        """
+        item = self.get_object()
+        return apply_membership_batch(request, item.customers, Customer, CustomerIdsBatchSerializer, 'customer_ids')
 
 
-class UserViewSet(viewsets.ReadOnlyModelViewSet):
+class UserViewSet(QueryPlanMixin, viewsets.ReadOnlyModelViewSet):
     """
     API endpoint for viewing users.
     Read-only access to user information.
@@ -296,7 +427,18 @@ def logout_view(request):
         )
 
 
-class PurchaseHistoryViewSet(viewsets.ModelViewSet):
+@extend_schema(
+    responses={200: OpenApiTypes.OBJECT},
+    description='Hit/miss counters of the server-side response cache, per namespace (staff only)'
+)
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def response_cache_stats(request):
+    """Report response cache hits, misses and hit rate for monitoring"""
+    return Response(response_cache.stats())
+
+
+class PurchaseHistoryViewSet(ConditionalGetMixin, QueryPlanMixin, viewsets.ModelViewSet):
     """
     API endpoint for managing purchase history.
     Supports filtering by customer.
@@ -304,13 +446,19 @@ class PurchaseHistoryViewSet(viewsets.ModelViewSet):
     Query Parameters:
     - customer: Filter by customer ID
     - customer__user__username: Filter by username
+    - from / to: Purchase date range (inclusive, YYYY-MM-DD)
+    - ordering: purchase_date, total_price or quantity (prefix with - for descending)
+    - pagination=cursor: Use cursor pagination (with optional page_size, max 100)
     """
-    queryset = PurchaseHistory.objects.select_related('customer', 'customer__user', 'item').all()
+    queryset = PurchaseHistory.objects.all()
     serializer_class = PurchaseHistorySerializer
     permission_classes = [permissions.IsAuthenticated]
-    filterset_fields = ['customer', 'item', 'customer__user__username']
+    conditional_namespace = 'purchase-history'
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    filterset_class = PurchaseHistoryFilter
+    pagination_class = OptInCursorPagination
     ordering_fields = ['purchase_date', 'total_price', 'quantity']
-    ordering = ['-purchase_date']
+    ordering = ['-purchase_date', '-id']
     
     def get_queryset(self):
         """
@@ -321,10 +469,10 @@ class PurchaseHistoryViewSet(viewsets.ModelViewSet):
         
         # If user is not staff, only show their own purchase history
         if not self.request.user.is_staff:
-            try:
-                customer = Customer.objects.get(user=self.request.user)
+            customer = get_customer_context(self.request).customer
+            if customer is not None:
                 queryset = queryset.filter(customer=customer)
-            except Customer.DoesNotExist:
+            else:
                 queryset = queryset.none()
         
         return queryset
@@ -332,40 +480,248 @@ class PurchaseHistoryViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def my_purchases(self, request):
         """Get purchase history for the authenticated user"""
-        try:
-            customer = Customer.objects.get(user=request.user)
-            purchases = self.get_queryset().filter(customer=customer)
-            
-            page = self.paginate_queryset(purchases)
-            if page is not None:
-                serializer = self.get_serializer(page, many=True)
-                return self.get_paginated_response(serializer.data)
-            
-            serializer = self.get_serializer(purchases, many=True)
-            return Response(serializer.data)
-        except Customer.DoesNotExist:
+        customer = get_customer_context(request).customer
+        if customer is None:
             return Response(
                 {'error': 'Customer profile not found'},
                 status=status.HTTP_404_NOT_FOUND
             )
+        
+        purchases = self.get_queryset().filter(customer=customer)
+        
+        page = self.paginate_queryset(purchases)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        
+        serializer = self.get_serializer(purchases, many=True)
+        return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
     def statistics(self, request):
-        """Get purchase statistics for the authenticated user"""
-        try:
-            customer = Customer.objects.get(user=request.user)
-            purchases = self.get_queryset().filter(customer=customer)
-            
-            total_purchases = purchases.count()
-            total_spent = sum(p.total_price for p in purchases)
-            
-            return Response({
-                'total_purchases': total_purchases,
-                'total_spent': str(total_spent),
-                'average_purchase': str(total_spent / total_purchases) if total_purchases > 0 else '0.00'
-            })
-        except Customer.DoesNotExist:
+        """
+        Get purchase statistics for the authenticated user.
+        
+        Query Parameters:
+        - from / to: Restrict to a purchase date range (inclusive, YYYY-MM-DD)
+        - group_by: Add a breakdown by day, week, month or item
+        """
+        group_by = request.query_params.get('group_by')
+        if group_by and group_by not in PurchaseHistoryQuerySet.GROUP_BY_CHOICES:
+            return Response(
+                {'error': f"group_by must be one of: {', '.join(PurchaseHistoryQuerySet.GROUP_BY_CHOICES)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        customer = get_customer_context(request).customer
+        if customer is None:
+            return Response(
+                {'error': 'Customer profile not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        filterset = PurchaseHistoryFilter(
+            request.query_params,
+            queryset=PurchaseHistory.objects.filter(customer=customer),
+            request=request,
+        )
+        if not filterset.is_valid():
+            return Response(filterset.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        purchases = filterset.qs
+        summary = purchases.summary()
+        data = {
+            'total_purchases': summary['total_purchases'],
+            'total_spent': str(summary['total_spent']),
+            'average_purchase': str(summary['average_purchase']),
+        }
+        
+        if group_by:
+            data['group_by'] = group_by
+            data['breakdown'] = [
+                {**row, 'total_spent': str(row['total_spent'].quantize(Decimal('0.01')))}
+                for row in purchases.breakdown(group_by)
+            ]
+        
+        return Response(data)
+    
+    bulk_max_rows = 10000
+    bulk_batch_size = 500
+    
+    @extend_schema(
+        request=PurchaseHistoryBulkRowSerializer(many=True),
+        responses={201: PurchaseHistoryBulkResponseSerializer, 400: PurchaseHistoryBulkResponseSerializer},
+    )
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        """
+        Create many purchases from a JSON array or an NDJSON body
+        (Content-Type: application/x-ndjson), up to 10,000 rows.
+        
+        Each row is {"customer": id, "item": id, "quantity": n, "notes": "..."}.
+        Invalid rows are reported by index and skipped; valid rows are inserted
+        with bulk_create in batches. Non-staff users can only record purchases
+        for their own customer profile.
+        """
+        rows = request.data
+        if not isinstance(rows, list) or not rows:
+            return Response(
+                {'error': 'Expected a non-empty JSON array or NDJSON body'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(rows) > self.bulk_max_rows:
+            return Response(
+                {'error': f'At most {self.bulk_max_rows} rows can be uploaded at once'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        errors = []
+        valid = []
+        for index, row in enumerate(rows):
+            if not isinstance(row, dict):
+                errors.append({'index': index, 'errors': {'non_field_errors': ['Expected a JSON object']}})
+                continue
+            serializer = PurchaseHistoryBulkRowSerializer(data=row)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                errors.append({'index': index, 'errors': serializer.errors})
+        
+        # One IN query per referenced model
+        customer_ids = set(
+            Customer.objects.filter(id__in={data['customer'] for _, data in valid}).values_list('id', flat=True)
+        )
+        item_prices = dict(
+            Item.objects.filter(id__in={data['item'] for _, data in valid}).values_list('id', 'unit_price')
+        )
+        own_customer = None if request.user.is_staff else get_customer_context(request).customer
+        own_customer_id = own_customer.pk if own_customer else None
+        
+        purchases = []
+        for index, data in valid:
+            row_errors = {}
+            if data['customer'] not in customer_ids:
+                row_errors['customer'] = [f"Invalid pk \"{data['customer']}\" - object does not exist."]
+            elif not request.user.is_staff and data['customer'] != own_customer_id:
+                row_errors['customer'] = ['You can only record purchases for your own customer profile.']
+            if data['item'] not in item_prices:
+                row_errors['item'] = [f"Invalid pk \"{data['item']}\" - object does not exist."]
+            if row_errors:
+                errors.append({'index': index, 'errors': row_errors})
+                continue
+            unit_price = item_prices[data['item']]
+            purchases.append(PurchaseHistory(
+                customer_id=data['customer'],
+                item_id=data['item'],
+                quantity=data['quantity'],
+                notes=data['notes'],
+                unit_price=unit_price,
+                total_price=data['quantity'] * unit_price,
+            ))
+        
+        ids = []
+        for start in range(0, len(purchases), self.bulk_batch_size):
+            batch = purchases[start:start + self.bulk_batch_size]
+            with transaction.atomic():
+                PurchaseHistory.objects.bulk_create(batch)
+                # bulk_create() skips post_save, so update the rollup here
+                MonthlySpend.add_purchases(batch)
+            ids.extend(purchase.pk for purchase in batch if purchase.pk is not None)
+        
+        errors.sort(key=lambda error: error['index'])
+        return Response(
+            {'created': len(purchases), 'ids': ids, 'errors': errors},
+            status=status.HTTP_201_CREATED if purchases else status.HTTP_400_BAD_REQUEST
+        )
+    
+    export_columns = [
+        'id', 'purchase_date', 'customer_id', 'customer_username',
+        'item_id', 'item_name', 'quantity', 'unit_price', 'total_price', 'notes',
+    ]
+    export_chunk_size = 2000
+    
+    @extend_schema(responses={(200, 'text/csv'): str, (200, 'application/x-ndjson'): str})
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream the purchase history as CSV or NDJSON.
+        Applies the same visibility rules, filters and ordering as the list.
+        
+        Query Parameters:
+        - output: csv (default) or ndjson
+        - customer, item, customer__user__username, from, to, ordering: as for the list
+        """
+        output = request.query_params.get('output', 'csv')
+        if output not in EXPORT_FORMATS:
+            return Response(
+                {'error': f"output must be one of: {', '.join(EXPORT_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        rows = (
+            self.filter_queryset(self.get_queryset())
+            .prefetch_related(None)
+            .values(
+                'id', 'purchase_date', 'customer_id', 'item_id',
+                'quantity', 'unit_price', 'total_price', 'notes',
+                customer_username=F('customer__user__username'),
+                item_name=F('item__name'),
+            )
+            .iterator(chunk_size=self.export_chunk_size)
+        )
+        if output == 'csv':
+            content = stream_csv(rows, self.export_columns)
+        else:
+            content = stream_ndjson(rows)
+        
+        response = StreamingHttpResponse(content, content_type=EXPORT_FORMATS[output])
+        response['Content-Disposition'] = f'attachment; filename="purchase-history.{output}"'
+        return response
+    
+    @extend_schema(responses=MonthlySpendSerializer(many=True))
+    @action(detail=False, methods=['get'])
+    def monthly(self, request):
+        """
+        Get month-by-month spend for the authenticated user, read from the
+        MonthlySpend rollup instead of individual purchases.
+        
+        Query Parameters:
+        - from / to: Month range (inclusive, YYYY-MM)
+        - item: Restrict to one item ID
+        """
+        customer = get_customer_context(request).customer
+        if customer is None:
             return Response(
                 {'error': 'Customer profile not found'},
                 status=status.HTTP_404_NOT_FOUND
             )
+        
+        rows = MonthlySpend.objects.filter(customer=customer)
+        for param, lookup in (('from', 'month__gte'), ('to', 'month__lte')):
+            value = request.query_params.get(param)
+            if not value:
+                continue
+            try:
+                month = datetime.strptime(value, '%Y-%m').date()
+            except ValueError:
+                return Response(
+                    {'error': f'{param} must be a month in YYYY-MM format'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            rows = rows.filter(**{lookup: month})
+        item_id = request.query_params.get('item')
+        if item_id:
+            if not item_id.isdigit():
+                return Response({'error': 'item must be an item ID'}, status=status.HTTP_400_BAD_REQUEST)
+            rows = rows.filter(item_id=item_id)
+        
+        months = rows.order_by('month').values('month').annotate(
+            purchases=Sum('purchase_count'),
+            total_quantity=Sum('quantity'),
+            total_spent=Sum('amount'),
+        )
+        serializer = MonthlySpendSerializer(
+            [{**row, 'quantity': row['total_quantity']} for row in months],
+            many=True
+        )
+        return Response(serializer.data)
@@ -45,6 +45,7 @@ INSTALLED_APPS = [
     'allauth.socialaccount',
     'rest_framework',
     'rest_framework.authtoken',
+    'django_filters',
     'drf_spectacular',
     
     # Local apps
@@ -56,10 +57,13 @@ SITE_ID = 1
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.middleware.ServerTimingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.middleware.CustomerContextMiddleware',
+    'api.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allauth.account.middleware.AccountMiddleware',  # Required for allauth
@@ -71,13 +75,21 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],  # Add templates directory
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Templates are compiled once per process and kept in memory.
+            # During development (runserver) the autoreloader clears this
+            # cache whenever a template file changes.
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
@@ -140,7 +152,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Django REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -150,6 +162,34 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Use a shared backend (Redis/Memcached) in production so cache
+# invalidation (e.g. on logout) reaches every process.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Seconds a token -> user lookup is cached by CachedTokenAuthentication
+TOKEN_AUTH_CACHE_TIMEOUT = 60
+
+# Seconds a list/detail response of the roles, companies and items
+# endpoints is kept by api.response_cache (0 disables the cache)
+RESPONSE_CACHE_TIMEOUT = 300
+
+# Log the Server-Timing numbers of every request as one JSON line on the
+# 'api.timing' logger (the header itself is always sent)
+SERVER_TIMING_LOG = False
+
+# Request profiling (api.middleware.ProfilingMiddleware). Staff can always
+# profile a request with ?_profile=1; PROFILE_SAMPLE_RATE = N also profiles
+# one request in N into PROFILE_DIR, keeping the newest PROFILE_KEEP (0 = off)
+PROFILE_SAMPLE_RATE = 0
+PROFILE_DIR = BASE_DIR / 'profiles'
+PROFILE_KEEP = 100
+
 # drf-spectacular settings
 SPECTACULAR_SETTINGS = {
     'TITLE': 'MonthlySpecs API',
@@ -41,13 +41,11 @@ class CustomSignupForm(SignupForm):
         if company:
             # Import here to avoid circular imports
             from api.models import Customer
-            # The Customer profile should have been created by the signal
+            # The Customer profile was created (and cached on the user) by the signal;
+            # adding the M2M row is the only write needed.
             try:
-                customer = Customer.objects.get(user=user)
+                customer = user.customer
                 customer.companies.add(company)
-                customer.save()
-                print(f"DEBUG: Successfully associated company {company.name} with customer {customer.user.username}")
-                print(f"DEBUG: Customer companies count: {customer.companies.count()}")
             except Customer.DoesNotExist:
                 # If for some reason the customer doesn't exist, 
                 # we'll skip the company association
@@ -0,0 +1,57 @@
+"""
+Keyset pagination for console pages.
+
+Pages are addressed by the (date, id) of the last row shown instead of an
+OFFSET, so each page is read straight from an index and costs the same no
+matter how deep into the history it is.
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+
+def encode_cursor(value, pk):
+    raw = f'{value.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return ``(datetime, pk)`` or None when the cursor is missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        value, pk = raw.rsplit('|', 1)
+        return datetime.fromisoformat(value), int(pk)
+    except ValueError:
+        return None
+
+
+class KeysetPage:
+    """
+    One page of ``queryset`` ordered by ``-<field>, -id``, starting after
+    ``cursor``. ``object_list`` holds at most ``page_size`` rows and
+    ``next_cursor`` is None on the last page.
+    """
+
+    def __init__(self, queryset, field, cursor=None, page_size=20):
+        queryset = queryset.order_by(f'-{field}', '-id')
+        position = decode_cursor(cursor)
+        if position is not None:
+            value, pk = position
+            queryset = queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': pk}))
+
+        rows = list(queryset[:page_size + 1])
+        self.object_list = rows[:page_size]
+        self.is_first = position is None
+        self.next_cursor = None
+        if len(rows) > page_size:
+            last = self.object_list[-1]
+            self.next_cursor = encode_cursor(getattr(last, field), last.pk)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
@@ -1,3 +1,223 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.template import engines
+from django.template.loaders.cached import Loader as CachedLoader
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from api.models import Company, Item, PurchaseHistory, Role
+from .views import COMPANY_EDITABLE_FIELDS, CUSTOMERS_PAGE_SIZE, PURCHASES_PAGE_SIZE
+
+
+class ConsoleTestMixin:
+    """Shared fixtures for console tests"""
+
+    def create_customer(self, username, role=Role.CUSTOMER, companies=()):
+        user = User.objects.create_user(username=username, email=f'{username}@example.com')
+        customer = user.customer
+        if role != Role.CUSTOMER:
+            customer.role = Role.objects.get(name=role)
+            customer.save()
+        customer.companies.add(*companies)
+        return customer
+
+
+class ConsoleAccessTests(ConsoleTestMixin, TestCase):
+    """Console pages use the request's customer context for access checks"""
+
+    def setUp(self):
+        self.company = Company.objects.create(name='Acme')
+        self.other_company = Company.objects.create(name='Other')
+        self.manager = self.create_customer('manager', Role.MANAGER, [self.company])
+        self.member = self.create_customer('member', companies=[self.company])
+
+    def test_manager_sees_company_members(self):
+        self.client.force_login(self.manager.user)
+        response = self.client.get(reverse('customer_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(c.user.username for c in response.context['customers']),
+            ['manager', 'member'],
+        )
+
+    def test_customer_cannot_see_customer_list(self):
+        self.client.force_login(self.member.user)
+        response = self.client.get(reverse('customer_list'))
+        self.assertRedirects(response, reverse('dashboard'))
+
+    def test_company_detail_requires_membership(self):
+        self.client.force_login(self.member.user)
+        response = self.client.get(reverse('company_detail', args=[self.company.id]))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('company_detail', args=[self.other_company.id]))
+        self.assertRedirects(response, reverse('company_list'))
+
+
+class PurchaseListTests(ConsoleTestMixin, TestCase):
+    """The purchase page is keyset-paginated, date-filtered and aggregated in SQL"""
+
+    def setUp(self):
+        self.customer = self.create_customer('buyer')
+        item = Item.objects.create(name='Widget', unit_price=Decimal('10.00'))
+        start = datetime(2025, 3, 1, 12, tzinfo=dt_timezone.utc)
+        purchases = [
+            PurchaseHistory.objects.create(customer=self.customer, item=item, quantity=1)
+            for _ in range(PURCHASES_PAGE_SIZE + 5)
+        ]
+        # Backdate one purchase per day; the first two share a timestamp
+        for index, purchase in enumerate(purchases):
+            purchase.purchase_date = start + timedelta(days=max(index - 1, 0))
+        PurchaseHistory.objects.bulk_update(purchases, ['purchase_date'])
+        self.client.force_login(self.customer.user)
+
+    def test_pages_cover_every_purchase_once(self):
+        response = self.client.get(reverse('purchase_list'))
+        first_page = [p.pk for p in response.context['purchases']]
+        self.assertEqual(len(first_page), PURCHASES_PAGE_SIZE)
+        self.assertEqual(response.context['total_purchases'], PURCHASES_PAGE_SIZE + 5)
+
+        cursor = response.context['purchases'].next_cursor
+        response = self.client.get(reverse('purchase_list'), {'cursor': cursor})
+        second_page = [p.pk for p in response.context['purchases']]
+        self.assertIsNone(response.context['purchases'].next_cursor)
+        self.assertEqual(
+            sorted(first_page + second_page),
+            sorted(PurchaseHistory.objects.values_list('pk', flat=True)),
+        )
+
+    def test_date_range(self):
+        response = self.client.get(reverse('purchase_list'), {'from': '2025-03-01', 'to': '2025-03-03'})
+        self.assertEqual(response.context['total_purchases'], 4)
+        self.assertEqual(response.context['total_spent'], Decimal('40.00'))
+        self.assertEqual(len(response.context['purchases']), 4)
+
+    def test_query_count_is_independent_of_history(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('purchase_list'))
+        PurchaseHistory.objects.bulk_create([
+            PurchaseHistory(customer=self.customer, item_id=PurchaseHistory.objects.first().item_id,
+                            quantity=1, unit_price=Decimal('1'), total_price=Decimal('1'))
+            for _ in range(100)
+        ])
+        with self.assertNumQueries(len(ctx.captured_queries)):
+            self.client.get(reverse('purchase_list'))
+
+
+
+class CustomerListTests(ConsoleTestMixin, TestCase):
+    """The customer list is paginated, searchable and filtered with EXISTS"""
+
+    def setUp(self):
+        self.company = Company.objects.create(name='Acme')
+        self.second_company = Company.objects.create(name='Beta')
+        self.manager = self.create_customer('manager', Role.MANAGER, [self.company, self.second_company])
+        self.client.force_login(self.manager.user)
+
+    def add_members(self, prefix, count, companies):
+        for index in range(count):
+            self.create_customer(f'{prefix}{index:03d}', companies=companies)
+
+    def test_pages_and_search(self):
+        # Members of both companies must still be listed once
+        self.add_members('user', CUSTOMERS_PAGE_SIZE + 5, [self.company, self.second_company])
+        self.create_customer('outsider', companies=[Company.objects.create(name='Other')])
+
+        response = self.client.get(reverse('customer_list'))
+        page = response.context['customers']
+        self.assertEqual(page.paginator.count, CUSTOMERS_PAGE_SIZE + 6)
+        self.assertEqual(len(page), CUSTOMERS_PAGE_SIZE)
+        response = self.client.get(reverse('customer_list'), {'page': 2})
+        self.assertEqual(len(response.context['customers']), 6)
+
+        response = self.client.get(reverse('customer_list'), {'q': 'USER00'})
+        self.assertEqual(
+            [c.user.username for c in response.context['customers']],
+            [f'user{index:03d}' for index in range(10)],
+        )
+        response = self.client.get(reverse('customer_list'), {'q': 'outsider'})
+        self.assertEqual(len(response.context['customers']), 0)
+
+    def test_query_count_is_independent_of_members(self):
+        self.add_members('first', 3, [self.company])
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('customer_list'))
+        sql = ' '.join(query['sql'] for query in ctx.captured_queries)
+        self.assertIn('EXISTS', sql)
+        self.assertNotIn('DISTINCT', sql)
+
+        self.add_members('second', 20, [self.company, self.second_company])
+        with self.assertNumQueries(len(ctx.captured_queries)):
+            self.client.get(reverse('customer_list'))
+
+
+class CompanyDetailTests(ConsoleTestMixin, TestCase):
+    """company_detail checks membership with EXISTS and saves only changed fields"""
+
+    def setUp(self):
+        self.company = Company.objects.create(name='Acme', phone='010')
+        self.manager = self.create_customer('manager', Role.MANAGER, [self.company])
+        self.url = reverse('company_detail', args=[self.company.id])
+        self.client.force_login(self.manager.user)
+
+    def test_member_count_in_fixed_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+        self.assertEqual(response.context['customer_count'], 1)
+
+        for index in range(5):
+            self.create_customer(f'member{index}', companies=[self.company])
+        with self.assertNumQueries(len(ctx.captured_queries)):
+            response = self.client.get(self.url)
+        self.assertEqual(response.context['customer_count'], 6)
+
+    def test_post_updates_changed_fields_only(self):
+        data = {field: getattr(self.company, field) for field in COMPANY_EDITABLE_FIELDS}
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(self.url, {**data, 'phone': '011'})
+        updates = [query['sql'] for query in ctx.captured_queries if query['sql'].startswith('UPDATE "api_company"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"phone"', updates[0])
+        self.assertNotIn('"description"', updates[0])
+        self.company.refresh_from_db()
+        self.assertEqual(self.company.phone, '011')
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(self.url, {**data, 'phone': '011'})
+        self.assertFalse([query for query in ctx.captured_queries if query['sql'].startswith('UPDATE "api_company"')])
+
+
+class TemplateCachingTests(ConsoleTestMixin, TestCase):
+    """The sidebar is cached per user and templates use the cached loader"""
+
+    def setUp(self):
+        cache.clear()
+        self.customer = self.create_customer('member')
+        self.client.force_login(self.customer.user)
+
+    def test_sidebar_fragment_follows_role_changes(self):
+        response = self.client.get(reverse('dashboard'))
+        self.assertContains(response, '구매 목록')
+        self.assertNotContains(response, '회원관리')
+        self.assertTrue(any('console_sidebar' in key for key in cache._cache))
+
+        self.customer.role = Role.objects.get(name=Role.MANAGER)
+        self.customer.save()
+        response = self.client.get(reverse('dashboard'))
+        self.assertContains(response, '회원관리')
+        self.assertNotContains(response, '구매 목록')
+
+    def test_sidebar_marks_current_page(self):
+        response = self.client.get(reverse('purchase_list'))
+        self.assertContains(response, 'href="/purchases/" class="active"')
+        response = self.client.get(reverse('dashboard'))
+        self.assertContains(response, 'href="/dashboard/" class="active"')
+        self.assertNotContains(response, 'href="/purchases/" class="active"')
 
-# Create your tests here.
+    def test_cached_template_loader(self):
+        loader = engines['django'].engine.template_loaders[0]
+        self.assertIsInstance(loader, CachedLoader)
@@ -1,10 +1,19 @@
 """
 Web views for rendering HTML pages (not API endpoints).
 """
+from django.core.paginator import Paginator
+from django.db.models import Exists, OuterRef, Prefetch, Q
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from api.context import get_customer_context
+from api.filters import PurchaseHistoryFilter
 from api.models import Customer, Company, PurchaseHistory
+from .pagination import KeysetPage
+
+CUSTOMERS_PAGE_SIZE = 50
+COMPANY_EDITABLE_FIELDS = ['name', 'description', 'address', 'phone', 'email', 'website']
+PURCHASES_PAGE_SIZE = 20
 
 
 def home(request):
@@ -20,14 +29,14 @@ def dashboard(request):
     Dashboard page - shows after login.
     Displays customer information if a Customer profile exists.
     """
-    try:
-        customer = Customer.objects.select_related('role').get(user=request.user)
-    except Customer.DoesNotExist:
-        customer = None
+    customer = get_customer_context(request).customer
+    # Evaluated once; the template reuses the result for the list and the count
+    companies = customer.companies.all() if customer else Company.objects.none()
     
     context = {
         'user': request.user,
         'customer': customer,
+        'companies': companies,
         'show_sidebar': True,  # Enable sidebar for dashboard
     }
     return render(request, 'dashboard.html', context)
@@ -38,30 +47,43 @@ def customer_list(request):
     """
     Customer list page - shows customers belonging to the same company.
     Only accessible to owners and managers.
+    Paginated (``?page=``) and searchable by username or email (``?q=``).
     """
-    try:
-        customer = Customer.objects.select_related('role').prefetch_related('companies').get(user=request.user)
-    except Customer.DoesNotExist:
+    customer_context = get_customer_context(request)
+    customer = customer_context.customer
+    if customer is None:
         messages.error(request, 'Customer profile not found.')
         return redirect('dashboard')
     
     # Check if user has owner or manager role
-    if not customer.role or customer.role.name not in ['owner', 'manager']:
+    if not customer_context.can_manage:
         messages.error(request, 'You do not have permission to view customers.')
         return redirect('dashboard')
     
     # Get all companies the current user belongs to
-    user_companies = customer.companies.all()
+    user_companies = Company.objects.filter(id__in=customer_context.company_ids)
+    
+    # Customers who belong to any of the same companies. EXISTS on the
+    # through table avoids the duplicate rows (and DISTINCT) of a join.
+    memberships = Customer.companies.through.objects.filter(
+        customer_id=OuterRef('pk'), company_id__in=customer_context.company_ids
+    )
+    customers = Customer.objects.filter(Exists(memberships))
+    
+    query = request.GET.get('q', '').strip()
+    if query:
+        customers = customers.filter(Q(user__username__icontains=query) | Q(user__email__icontains=query))
     
-    # Get all customers who belong to the same companies
-    customers = Customer.objects.filter(
-        companies__in=user_companies
-    ).select_related('user', 'role').prefetch_related('companies').distinct().order_by('user__username')
+    customers = customers.select_related('user', 'role').prefetch_related(
+        Prefetch('companies', queryset=Company.objects.only('id', 'name'))
+    ).order_by('user__username', 'id')
+    page = Paginator(customers, CUSTOMERS_PAGE_SIZE).get_page(request.GET.get('page'))
     
     context = {
         'user': request.user,
         'customer': customer,
-        'customers': customers,
+        'customers': page,
+        'query': query,
         'user_companies': user_companies,
         'show_sidebar': True,
     }
@@ -73,14 +95,18 @@ def company_list(request):
     """
     Company list page - shows companies the user belongs to.
     """
-    try:
-        customer = Customer.objects.select_related('role').prefetch_related('companies').get(user=request.user)
-    except Customer.DoesNotExist:
+    customer_context = get_customer_context(request)
+    customer = customer_context.customer
+    if customer is None:
         messages.error(request, '고객 프로필을 찾을 수 없습니다.')
         return redirect('dashboard')
     
     # Get all companies the current user belongs to
-    companies = customer.companies.all().order_by('name')
+    companies = (
+        Company.objects.filter(id__in=customer_context.company_ids)
+        .with_customer_count()
+        .order_by('name')
+    )
     
     context = {
         'user': request.user,
@@ -98,47 +124,53 @@ def company_detail(request, company_id):
     Only users who belong to the company can view/edit it.
     Only owners and managers can edit.
     """
-    try:
-        customer = Customer.objects.select_related('role').prefetch_related('companies').get(user=request.user)
-    except Customer.DoesNotExist:
+    customer_context = get_customer_context(request)
+    customer = customer_context.customer
+    if customer is None:
         messages.error(request, '고객 프로필을 찾을 수 없습니다.')
         return redirect('dashboard')
     
-    # Get the company and verify user has access to it
-    company = get_object_or_404(Company, id=company_id)
+    # Load the company, its member count and the user's membership in one query
+    is_member = Customer.companies.through.objects.filter(
+        company_id=OuterRef('pk'), customer_id=customer.pk
+    )
+    company = get_object_or_404(
+        Company.objects.with_customer_count().annotate(is_member=Exists(is_member)),
+        id=company_id,
+    )
     
-    if company not in customer.companies.all():
+    if not company.is_member:
         messages.error(request, '이 회사 정보에 접근할 권한이 없습니다.')
         return redirect('company_list')
     
     # Check if user can edit (only owner and manager)
-    can_edit = customer.role and customer.role.name in ['owner', 'manager']
+    can_edit = customer_context.can_manage
     
     if request.method == 'POST' and can_edit:
-        # Update company information
-        company.name = request.POST.get('name', company.name)
-        company.description = request.POST.get('description', company.description)
-        company.address = request.POST.get('address', company.address)
-        company.phone = request.POST.get('phone', company.phone)
-        company.email = request.POST.get('email', company.email)
-        company.website = request.POST.get('website', company.website)
+        # Update company information, writing only the fields that changed
+        changed = []
+        for field in COMPANY_EDITABLE_FIELDS:
+            value = request.POST.get(field, getattr(company, field))
+            if value != getattr(company, field):
+                setattr(company, field, value)
+                changed.append(field)
         
+        if not changed:
+            messages.info(request, '변경된 내용이 없습니다.')
+            return redirect('company_detail', company_id=company.id)
         try:
-            company.save()
+            company.save(update_fields=changed + ['updated_at'])
             messages.success(request, f'{company.name} 정보가 성공적으로 업데이트되었습니다.')
             return redirect('company_detail', company_id=company.id)
         except Exception as e:
             messages.error(request, f'업데이트 중 오류가 발생했습니다: {str(e)}')
     
-    # Get customer count for this company
-    customer_count = customer.companies.filter(id=company_id).first().customers.count() if company else 0
-    
     context = {
         'user': request.user,
         'customer': customer,
         'company': company,
         'can_edit': can_edit,
-        'customer_count': customer_count,
+        'customer_count': company.customer_count,
         'show_sidebar': True,
     }
     return render(request, 'company_detail.html', context)
@@ -149,30 +181,40 @@ def purchase_list(request):
     """
     Purchase history page - shows purchase history for the logged-in customer.
     Only accessible to customers.
+    The table is keyset-paginated by purchase date (``?cursor=``) and can be
+    limited to a date range (``?from=YYYY-MM-DD&to=YYYY-MM-DD``); the
+    summary cards cover the whole range.
     """
-    try:
-        customer = Customer.objects.select_related('role').get(user=request.user)
-    except Customer.DoesNotExist:
+    customer = get_customer_context(request).customer
+    if customer is None:
         messages.error(request, '고객 프로필을 찾을 수 없습니다.')
         return redirect('dashboard')
     
-    # Get all purchase history for this customer
-    purchases = PurchaseHistory.objects.filter(
-        customer=customer
-    ).select_related('item').order_by('-purchase_date')
+    # Restrict to the requested date range (same semantics as the API)
+    date_range = PurchaseHistoryFilter(
+        {key: request.GET[key] for key in ('from', 'to') if request.GET.get(key)},
+        queryset=PurchaseHistory.objects.filter(customer=customer),
+    )
+    purchases = date_range.qs if date_range.is_valid() else date_range.queryset
+    
+    # Calculate statistics in a single aggregate query
+    summary = purchases.summary()
     
-    # Calculate statistics
-    total_purchases = purchases.count()
-    total_spent = sum(p.total_price for p in purchases)
-    average_purchase = total_spent / total_purchases if total_purchases > 0 else 0
+    page = KeysetPage(
+        purchases.select_related('item'),
+        'purchase_date',
+        cursor=request.GET.get('cursor'),
+        page_size=PURCHASES_PAGE_SIZE,
+    )
     
     context = {
         'user': request.user,
         'customer': customer,
-        'purchases': purchases,
-        'total_purchases': total_purchases,
-        'total_spent': total_spent,
-        'average_purchase': average_purchase,
+        'purchases': page,
+        'date_range': date_range.form,
+        'total_purchases': summary['total_purchases'],
+        'total_spent': summary['total_spent'],
+        'average_purchase': summary['average_purchase'],
         'show_sidebar': True,
     }
     return render(request, 'purchases.html', context)